@@ -1,29 +1,54 @@
-from fastapi import FastAPI, Form, Request
-from fastapi.middleware.cors import CORSMiddleware
+import asyncio
+import functools
+import json
+import time
+from contextlib import asynccontextmanager
 
-from integrations.airtable import (
-    authorize_airtable,
-    get_items_airtable,
-    oauth2callback_airtable,
-    get_airtable_credentials
-)
-from integrations.notion import (
-    authorize_notion,
-    get_items_notion,
-    oauth2callback_notion,
-    get_notion_credentials
-)
-from integrations.hubspot import (
-    authorize_hubspot,
-    get_hubspot_credentials,
-    get_items_hubspot,
-    oauth2callback_hubspot
-)
+from fastapi import FastAPI, Form, HTTPException, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
+
+import credential_store
+import hierarchy
+import http_client
+import loader
+import metrics
+import offload
+import providers
+import query
+import search_index
+import singleflight
+import streaming
+from config import cache as cache_config
+from config import credentials as credentials_config
+from config import offload as offload_config
+from config import search as search_config
+
+
+@asynccontextmanager
+async def _lifespan(app):
+    """Open shared provider HTTP clients and start background tasks on startup."""
+    credential_store.check_keys()
+    http_client.start_clients(list(providers.PROVIDERS))
+    tasks = []
+    if credentials_config['refresh_interval'] > 0:
+        tasks.append(asyncio.create_task(credential_store.run_refresher()))
+    if offload_config['lag_interval'] > 0:
+        tasks.append(asyncio.create_task(metrics.monitor_loop_lag(
+            offload_config['lag_interval'], offload_config['lag_target']
+        )))
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        offload.shutdown()
+        await http_client.close_clients()
 
 
 def _create_app():
     """Create and configure FastAPI application."""
-    app = FastAPI(title="Integrations API")
+    app = FastAPI(title="Integrations API", lifespan=_lifespan)
 
     # CORS config
     origins = ["http://localhost:3000"]  # React app address
@@ -34,6 +59,7 @@ def _create_app():
         allow_methods=["*"],
         allow_headers=["*"]
     )
+    metrics.instrument_app(app)
 
     return app
 
@@ -41,100 +67,312 @@ def _create_app():
 app = _create_app()
 
 
-@app.get('/')
-def read_root():
-    """Health check endpoint."""
-    return {'status': 'ok'}
-
-
-# Airtable Integration Routes
-@app.post('/integrations/airtable/authorize')
-async def authorize_airtable_integration(
-    user_id: str = Form(...),
-    org_id: str = Form(...)
+async def _get_credentials(provider, credentials, user_id, org_id):
+    """Return the request's credentials, or the user's stored credentials."""
+    if credentials:
+        return credentials
+    if not user_id or not org_id:
+        raise HTTPException(
+            status_code=400,
+            detail='credentials, or user_id and org_id, are required.'
+        )
+    return json.dumps(await credential_store.get_credentials(provider, org_id, user_id))
+
+
+async def _load(
+    provider,
+    credentials,
+    stream=False,
+    refresh=False,
+    incremental=False,
+    user_id=None,
+    org_id=None,
+    item_type=None,
+    name_prefix=None,
+    sort=None,
+    limit=None,
+    cursor=None
 ):
-    """Initialize Airtable OAuth flow."""
-    return await authorize_airtable(user_id, org_id)
-
-
-@app.get('/integrations/airtable/oauth2callback')
-async def oauth2callback_airtable_integration(request: Request):
-    """Handle Airtable OAuth callback."""
-    return await oauth2callback_airtable(request)
+    """Serve a /load request as a cached, streamed or incremental load.
+
+    Without ``credentials``, the user's stored credentials are used. Filter,
+    sort and paging parameters are evaluated against the cached load result.
+    """
+    credentials = await _get_credentials(provider, credentials, user_id, org_id)
+    if any(param is not None for param in (item_type, name_prefix, sort, limit, cursor)):
+        if stream or incremental:
+            raise HTTPException(
+                status_code=400,
+                detail='Filter, sort and paging parameters cannot be combined with stream or incremental.'
+            )
+        result = await loader.get_query_result(
+            provider, credentials, providers.get_handler(provider, 'get_items'),
+            query.query_fingerprint(item_type, name_prefix, sort),
+            functools.partial(
+                query.run_query, item_type=item_type, name_prefix=name_prefix, sort=sort
+            ),
+            refresh
+        )
+        return streaming.ItemsResponse(query.page_result(result, limit, cursor))
+    if incremental:
+        if not user_id or not org_id:
+            raise HTTPException(
+                status_code=400,
+                detail='user_id and org_id are required for incremental sync.'
+            )
+        return streaming.ItemsResponse(await loader.sync_items(
+            provider, credentials, org_id, user_id,
+            providers.get_handler(provider, 'get_items'),
+            providers.get_handler(provider, 'get_changed_items')
+        ))
+    if stream:
+        return await streaming.ndjson_response(loader.iter_items(
+            provider, credentials, providers.get_handler(provider, 'iter_items'), refresh
+        ))
+    return Response(await loader.load_payload(
+        provider, credentials, providers.get_handler(provider, 'get_items'), refresh
+    ), media_type='application/json')
+
+
+def _check_providers(names):
+    unknown = [name for name in names if name not in providers.PROVIDERS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f'Unknown provider: {", ".join(unknown)}.')
+
+
+async def _load_provider(provider, credentials, user_id, org_id, refresh, skip_missing):
+    """Load one provider's items for the aggregate load.
+
+    With ``skip_missing``, a provider without stored credentials gives None.
+    """
+    try:
+        credentials = await _get_credentials(provider, credentials, user_id, org_id)
+    except credential_store.CredentialsNotFound:
+        if skip_missing:
+            return None
+        raise
+    return await loader.load_items(
+        provider, credentials, providers.get_handler(provider, 'get_items'), refresh
+    )
 
 
-@app.post('/integrations/airtable/credentials')
-async def get_airtable_credentials_integration(
-    user_id: str = Form(...),
-    org_id: str = Form(...)
-):
-    """Retrieve Airtable credentials."""
-    return await get_airtable_credentials(user_id, org_id)
+async def _search_provider(provider, org_id, user_id, q, item_type, limit):
+    """Search one provider's synced snapshot, syncing it first if there is none.
+
+    A snapshot older than the provider's cache TTL is synced again first, so
+    search results are no staler than /load's. Concurrent searches of one
+    user's provider share a single sync.
+    """
+    synced_since = time.time() - cache_config['ttl'].get(provider, 0)
+    index = await search_index.get_index(provider, org_id, user_id, synced_since)
+    if index is None:
+        async def _sync():
+            credentials = json.dumps(await credential_store.get_credentials(provider, org_id, user_id))
+            await loader.sync_items(
+                provider, credentials, org_id, user_id,
+                providers.get_handler(provider, 'get_items'),
+                providers.get_handler(provider, 'get_changed_items')
+            )
+            return await search_index.get_index(provider, org_id, user_id)
+
+        index = await singleflight.run(
+            f'sync:{provider}:{org_id}:{user_id}', _sync,
+            read=lambda: search_index.get_index(provider, org_id, user_id, synced_since)
+        )
+    return index.search(q, limit, item_type) if index is not None else []
+
+
+def _add_provider_routes(app, provider):
+    """Register the OAuth and /load routes of one provider.
+
+    Handlers are looked up on each request, so a provider's integration
+    module is only imported once one of its routes is first used.
+    """
+    name = providers.PROVIDERS[provider]
+    prefix = f'/integrations/{provider}'
+
+    async def authorize(user_id: str = Form(...), org_id: str = Form(...)):
+        return await providers.get_handler(provider, 'authorize')(user_id, org_id)
+
+    async def oauth2callback(request: Request):
+        return await providers.get_handler(provider, 'oauth2callback')(request)
+
+    async def get_credentials(user_id: str = Form(...), org_id: str = Form(...)):
+        return await providers.get_handler(provider, 'credentials')(user_id, org_id)
+
+    async def load_items(
+        credentials: str = Form(None),
+        stream: bool = Form(False),
+        refresh: bool = Form(False),
+        incremental: bool = Form(False),
+        user_id: str = Form(None),
+        org_id: str = Form(None),
+        item_type: str = Form(None),
+        name_prefix: str = Form(None),
+        sort: str = Form(None),
+        limit: int = Form(None),
+        cursor: str = Form(None)
+    ):
+        return await _load(
+            provider, credentials, stream, refresh, incremental, user_id, org_id,
+            item_type, name_prefix, sort, limit, cursor
+        )
+
+    async def get_subtree(
+        credentials: str = Form(None),
+        user_id: str = Form(None),
+        org_id: str = Form(None),
+        item_id: str = Form(None),
+        depth: int = Form(1),
+        refresh: bool = Form(False)
+    ):
+        credentials = await _get_credentials(provider, credentials, user_id, org_id)
+        index = await loader.get_hierarchy(
+            provider, credentials, providers.get_handler(provider, 'get_items'), refresh
+        )
+        return streaming.ItemsResponse(hierarchy.subtree(index, item_id, depth))
+
+    app.add_api_route(
+        f'{prefix}/authorize', authorize, methods=['POST'],
+        name=f'authorize_{provider}_integration',
+        description=f'Initialize {name} OAuth flow.'
+    )
+    app.add_api_route(
+        f'{prefix}/oauth2callback', oauth2callback, methods=['GET'],
+        name=f'oauth2callback_{provider}_integration',
+        description=f'Handle {name} OAuth callback.'
+    )
+    app.add_api_route(
+        f'{prefix}/credentials', get_credentials, methods=['POST'],
+        name=f'get_{provider}_credentials_integration',
+        description=f'Return whether {name} is connected and when its token expires.'
+    )
+    app.add_api_route(
+        f'{prefix}/load', load_items, methods=['POST'],
+        response_class=streaming.ItemsResponse,
+        name=f'get_{provider}_items',
+        description=f'Load {name} items, optionally streamed as NDJSON or synced incrementally.'
+    )
+    app.add_api_route(
+        f'{prefix}/subtree', get_subtree, methods=['POST'],
+        response_class=streaming.ItemsResponse,
+        name=f'get_{provider}_subtree',
+        description=f'Return {name} items under item_id (or the top-level items) down to depth levels.'
+    )
 
 
-@app.post('/integrations/airtable/load')
-async def get_airtable_items(credentials: str = Form(...)):
-    """Load Airtable items."""
-    return await get_items_airtable(credentials)
+@app.get('/')
+def read_root():
+    """Health check endpoint."""
+    return {'status': 'ok'}
 
 
-# Notion Integration Routes
-@app.post('/integrations/notion/authorize')
-async def authorize_notion_integration(
-    user_id: str = Form(...),
-    org_id: str = Form(...)
-):
-    """Initialize Notion OAuth flow."""
-    return await authorize_notion(user_id, org_id)
+@app.get('/metrics')
+def get_metrics():
+    """Expose Prometheus metrics."""
+    body, content_type = metrics.render()
+    return Response(content=body, headers={'Content-Type': content_type})
 
 
-@app.get('/integrations/notion/oauth2callback')
-async def oauth2callback_notion_integration(request: Request):
-    """Handle Notion OAuth callback."""
-    return await oauth2callback_notion(request)
+for _provider in providers.PROVIDERS:
+    _add_provider_routes(app, _provider)
 
 
-@app.post('/integrations/notion/credentials')
-async def get_notion_credentials_integration(
-    user_id: str = Form(...),
-    org_id: str = Form(...)
+@app.post('/integrations/load')
+async def load_all_items(
+    credentials: str = Form(None),
+    user_id: str = Form(None),
+    org_id: str = Form(None),
+    provider: list[str] = Form(None),
+    refresh: bool = Form(False)
 ):
-    """Retrieve Notion credentials."""
-    return await get_notion_credentials(user_id, org_id)
-
-
-@app.post('/integrations/notion/load')
-async def get_notion_items(credentials: str = Form(...)):
-    """Load Notion items."""
-    return await get_items_notion(credentials)
-
-
-# HubSpot Integration Routes
-@app.post('/integrations/hubspot/authorize')
-async def authorize_hubspot_integration(
+    """Load several providers concurrently, streaming each as it finishes.
+
+    ``credentials`` is a JSON object of credentials by provider. Providers
+    missing from it use the stored credentials of ``user_id``/``org_id``;
+    unless ``provider`` names them, those that were never connected are left out.
+    """
+    try:
+        given = json.loads(credentials) if credentials else {}
+    except ValueError:
+        given = None
+    if not isinstance(given, dict):
+        raise HTTPException(status_code=400, detail='credentials must be a JSON object by provider.')
+    if provider:
+        loaded = provider
+    elif user_id and org_id:
+        loaded = list(providers.PROVIDERS)
+    else:
+        loaded = list(given)
+    _check_providers(loaded)
+
+    loads = {}
+    for name in loaded:
+        name_credentials = given.get(name)
+        if name_credentials is not None and not isinstance(name_credentials, str):
+            name_credentials = json.dumps(name_credentials)
+        loads[name] = _load_provider(
+            name, name_credentials, user_id, org_id, refresh,
+            skip_missing=not provider and name not in given
+        )
+    return streaming.completed_response(loads)
+
+
+@app.post('/integrations/search')
+async def search_items(
     user_id: str = Form(...),
-    org_id: str = Form(...)
+    org_id: str = Form(...),
+    q: str = Form(...),
+    provider: list[str] = Form(None),
+    item_type: str = Form(None),
+    limit: int = Form(None)
 ):
-    """Initialize HubSpot OAuth flow."""
-    return await authorize_hubspot(user_id, org_id)
-
-
-@app.get('/integrations/hubspot/oauth2callback')
-async def oauth2callback_hubspot_integration(request: Request):
-    """Handle HubSpot OAuth callback."""
-    return await oauth2callback_hubspot(request)
-
-
-@app.post('/integrations/hubspot/credentials')
-async def get_hubspot_credentials_integration(
-    user_id: str = Form(...),
-    org_id: str = Form(...)
+    """Search item names and types across a user's connected providers.
+
+    Every query word must match a word of the item's name or type, or the
+    start of one. Providers without stored credentials are skipped, and
+    failures are reported per provider under ``errors``.
+    """
+    limit = search_config['default_limit'] if limit is None else limit
+    if not 0 < limit <= search_config['max_limit']:
+        raise HTTPException(
+            status_code=400,
+            detail=f'limit must be between 1 and {search_config["max_limit"]}.'
+        )
+    searched = provider or list(providers.PROVIDERS)
+    _check_providers(searched)
+
+    results = await asyncio.gather(
+        *(_search_provider(name, org_id, user_id, q, item_type, limit) for name in searched),
+        return_exceptions=True
+    )
+    ranked = []
+    errors = {}
+    for name, result in zip(searched, results):
+        if isinstance(result, credential_store.CredentialsNotFound) and provider is None:
+            # The provider is not connected
+            continue
+        if isinstance(result, HTTPException):
+            errors[name] = result.detail
+        elif isinstance(result, Exception):
+            errors[name] = str(result)
+        else:
+            ranked.extend((rank, name, item) for rank, item in result)
+    ranked.sort(key=lambda match: match[0])
+    return ORJSONResponse({
+        'results': [{'provider': name, 'item': item} for _, name, item in ranked[:limit]],
+        'errors': errors
+    })
+
+
+@app.post('/integrations/airtable/records')
+async def get_airtable_records(
+    credentials: str = Form(None),
+    user_id: str = Form(None),
+    org_id: str = Form(None)
 ):
-    """Retrieve HubSpot credentials."""
-    return await get_hubspot_credentials(user_id, org_id)
-
-
-@app.post('/integrations/hubspot/load')
-async def get_hubspot_items(credentials: str = Form(...)):
-    """Load HubSpot items."""
-    return await get_items_hubspot(credentials)
+    """Stream Airtable records from every table as NDJSON."""
+    credentials = await _get_credentials('airtable', credentials, user_id, org_id)
+    return await streaming.ndjson_response(loader.iter_records(
+        'airtable', credentials, providers.get_handler('airtable', 'iter_records')
+    ))
@@ -0,0 +1,97 @@
+"""Build time and query latency of the in-memory search index.
+
+Indexes synthetic items whose names draw on a random vocabulary, then times
+a mix of exact, prefix, multi-word and type-filtered searches:
+
+    python -m benchmarks.bench_search --items 500000
+
+Broad terms walk every item in rank order. Narrower ones sort their
+candidates on first search (``cold``) and reuse that order later (``warm``).
+"""
+import argparse
+import os
+import random
+import statistics
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from integrations.integration_item import IntegrationItem  # noqa: E402
+from search_index import SearchIndex  # noqa: E402
+
+_TYPES = ('Base', 'Table', 'page', 'database', 'Contact', 'Company')
+
+
+def _items(n, rng):
+    words = [
+        ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9)))
+        for _ in range(20_000)
+    ]
+    items = [
+        IntegrationItem(
+            id=str(i),
+            type=rng.choice(_TYPES),
+            name=' '.join(rng.choice(words) for _ in range(3)) + f' {i}'
+        )
+        for i in range(n)
+    ]
+    return items, words
+
+
+def _queries(words):
+    return [
+        ('exact word', words[5], None),
+        ('type word', 'page', None),
+        ('two letter prefix', words[5][:2], None),
+        ('one letter prefix', words[8][:1], None),
+        ('word and prefix', f'{words[7]} {words[9][:3]}', None),
+        ('prefix, type filter', words[5][:2], 'Table'),
+        ('number prefix', '1', None),
+    ]
+
+
+def run(n, limit, repeat, seed=0):
+    """Return the build time and per-query latencies, in milliseconds."""
+    items, words = _items(n, random.Random(seed))
+    start = time.perf_counter()
+    index = SearchIndex()
+    index.add(items)
+    results = {'build_ms': (time.perf_counter() - start) * 1000, 'queries': []}
+
+    for label, query, item_type in _queries(words):
+        start = time.perf_counter()
+        found = index.search(query, limit, item_type)
+        cold = (time.perf_counter() - start) * 1000
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            index.search(query, limit, item_type)
+            samples.append((time.perf_counter() - start) * 1000)
+        results['queries'].append((label, len(found), cold, statistics.median(samples)))
+
+    start = time.perf_counter()
+    index.add(items[:100])
+    index.remove(items[100:200])
+    results['update_ms'] = (time.perf_counter() - start) * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=500_000)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    results = run(args.items, args.limit, args.repeat)
+    print(f"indexed {args.items} items in {results['build_ms']:.0f} ms")
+    print(f"{'query':<24}{'results':>8}{'cold ms':>10}{'warm ms':>10}")
+    for label, found, cold, warm in results['queries']:
+        print(f'{label:<24}{found:>8}{cold:>10.2f}{warm:>10.2f}')
+    print(f"update of 100 items and removal of 100: {results['update_ms']:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
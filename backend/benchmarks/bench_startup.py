@@ -0,0 +1,72 @@
+"""Worker cold-start cost of the API: import time, resident memory and modules.
+
+Each repeat imports ``api`` in a fresh interpreter, as a new uvicorn worker
+would, then imports every provider module as the first requests would:
+
+    python -m benchmarks.bench_startup --repeat 10
+
+Run it on two checkouts to compare startup before and after a change.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; ru_maxrss is reported in KiB on Linux
+_PROBE = """
+import importlib, json, resource, sys, time
+start = time.perf_counter()
+import api
+ready = time.perf_counter()
+ready_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+ready_modules = len(sys.modules)
+for provider in ('airtable', 'notion', 'hubspot'):
+    importlib.import_module(f'integrations.{provider}')
+loaded = time.perf_counter()
+print(json.dumps({
+    'import_ms': (ready - start) * 1000,
+    'import_rss_mb': ready_rss / 1024,
+    'import_modules': ready_modules,
+    'providers_ms': (loaded - ready) * 1000,
+    'providers_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'providers_modules': len(sys.modules)
+}))
+"""
+
+
+def _probe():
+    output = subprocess.run(
+        [sys.executable, '-c', _PROBE],
+        cwd=_BACKEND_DIR,
+        check=True,
+        capture_output=True,
+        text=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def run(repeat):
+    """Return the median of each startup measurement over ``repeat`` runs."""
+    samples = [_probe() for _ in range(repeat)]
+    return {key: statistics.median(s[key] for s in samples) for key in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    print(f"{'stage':<24}{'ms':>10}{'max RSS MB':>12}{'modules':>10}")
+    print(f"{'import api':<24}{results['import_ms']:>10.1f}"
+          f"{results['import_rss_mb']:>12.1f}{results['import_modules']:>10.0f}")
+    print(f"{'+ provider modules':<24}{results['providers_ms']:>10.1f}"
+          f"{results['providers_rss_mb']:>12.1f}{results['providers_modules']:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""Microbenchmarks for the per-item transformation hot paths.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_transforms                  # print results
+    python -m benchmarks.bench_transforms --save           # record baseline.json
+    python -m benchmarks.bench_transforms --compare        # fail on regressions
+
+Results are reported as nanoseconds per item (best of several repeats) so
+that runs at different scales can be compared directly.
+"""
+import argparse
+import functools
+import json
+import os
+import platform
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from integrations import airtable, hubspot, notion  # noqa: E402
+import json_stream  # noqa: E402
+import orjson  # noqa: E402
+from integrations.integration_item import (  # noqa: E402
+    deserialize_items,
+    serialize_item_lines,
+    serialize_items,
+)
+
+_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+_DEFAULT_SCALES = (1_000, 10_000, 100_000)
+
+
+def _airtable_tables(n):
+    return [
+        {
+            'id': f'tbl{i:014d}',
+            'name': f'Table {i}',
+            'primaryFieldId': f'fld{i:014d}',
+            'fields': [
+                {'id': f'fld{i:014d}', 'name': 'Name', 'type': 'singleLineText'},
+                {'id': f'fldx{i:013d}', 'name': 'Notes', 'type': 'multilineText'}
+            ],
+            'views': [{'id': f'viw{i:014d}', 'name': 'Grid view', 'type': 'grid'}]
+        }
+        for i in range(n)
+    ]
+
+
+def _airtable_records(n):
+    return [
+        {
+            'id': f'rec{i:014d}',
+            'createdTime': '2024-01-01T00:00:00.000Z',
+            'fields': {'fld00000000000001': f'Row {i}'}
+        }
+        for i in range(n)
+    ]
+
+
+def _notion_results(n):
+    return [
+        {
+            'object': 'page',
+            'id': f'{i:08x}-0000-0000-0000-000000000000',
+            'created_time': '2024-01-01T00:00:00.000Z',
+            'last_edited_time': '2024-02-01T00:00:00.000Z',
+            'parent': (
+                {'type': 'workspace', 'workspace': True}
+                if i % 10 == 0 else
+                {'type': 'page_id', 'page_id': f'{i - i % 10:08x}-0000-0000-0000-000000000000'}
+            ),
+            'properties': {
+                'Status': {'id': 'a', 'type': 'select', 'select': {'name': 'Done', 'color': 'green'}},
+                'Tags': {'id': 'b', 'type': 'multi_select', 'multi_select': [{'name': 'x'}, {'name': 'y'}]},
+                'Notes': {
+                    'id': 'c',
+                    'type': 'rich_text',
+                    'rich_text': [{'type': 'text', 'text': {'content': 'note'}, 'plain_text': 'note'}]
+                },
+                'Name': {
+                    'id': 'title',
+                    'type': 'title',
+                    'title': [{'type': 'text', 'text': {'content': f'Page {i}'}, 'plain_text': f'Page {i}'}]
+                }
+            }
+        }
+        for i in range(n)
+    ]
+
+
+def _hubspot_results(n):
+    return [
+        {
+            'id': str(i),
+            'properties': {'firstname': 'Ada', 'lastname': f'Lovelace {i}', 'name': None},
+            'createdAt': '2024-01-01T00:00:00.000Z',
+            'updatedAt': '2024-02-01T00:00:00.000Z',
+            'archived': False
+        }
+        for i in range(n)
+    ]
+
+
+def _notion_results_with_duplicates(n):
+    # Search pages can repeat objects; a tenth of the results are repeats
+    results = _notion_results(n - n // 10)
+    return results + results[:n // 10]
+
+
+def _parse_page(body, path, convert):
+    """Stream-parse a page body chunk by chunk, converting each element."""
+    size = json_stream._CHUNK_SIZE
+    parser = json_stream.ArrayParser(path, ['next_cursor'], convert)
+    items = [
+        item
+        for start in range(0, len(body), size)
+        for item in parser.feed(body[start:start + size])
+    ]
+    items.extend(parser.close())
+    return items
+
+
+def _cases(n):
+    """Build (name, callable) pairs that each process n items."""
+    tables = _airtable_tables(n)
+    records = _airtable_records(n)
+    table = {'id': 'tbl00000000000001', 'name': 'Table', 'primaryFieldId': 'fld00000000000001'}
+    notion_results = _notion_results(n)
+    notion_duplicates = [
+        notion._create_integration_item_metadata_object(r)
+        for r in _notion_results_with_duplicates(n)
+    ]
+    notion_page = orjson.dumps({'results': notion_results, 'has_more': False})
+    hubspot_results = _hubspot_results(n)
+    hubspot_page = orjson.dumps({'results': hubspot_results})
+    hubspot_convert = functools.partial(hubspot._create_integration_item_metadata_object, item_type='contact')
+    items = [notion._create_integration_item_metadata_object(r) for r in notion_results]
+    payload = serialize_items(items)
+
+    return [
+        ('airtable.create_item', lambda: [
+            airtable._create_integration_item_metadata_object(t, 'Table', 'app1', 'Base')
+            for t in tables
+        ]),
+        ('airtable.create_record', lambda: [
+            airtable._create_record_item(r, table) for r in records
+        ]),
+        ('notion.create_item', lambda: [
+            notion._create_integration_item_metadata_object(r) for r in notion_results
+        ]),
+        ('notion.get_item_name', lambda: [notion._get_item_name(r) for r in notion_results]),
+        ('notion.dedupe', lambda: notion._create_unique_items(notion_duplicates, set())),
+        ('notion.convert_page', lambda: json_stream.parse_array(
+            notion_page, 'results', ['next_cursor'], notion._convert_result
+        )),
+        ('notion.parse_page', lambda: _parse_page(
+            notion_page, 'results', notion._convert_result
+        )),
+        ('hubspot.create_item', lambda: [
+            hubspot._create_integration_item_metadata_object(r, 'contact')
+            for r in hubspot_results
+        ]),
+        ('hubspot.convert_page', lambda: json_stream.parse_array(
+            hubspot_page, 'results', ['paging.next.after'], hubspot_convert
+        )),
+        ('hubspot.parse_page', lambda: _parse_page(hubspot_page, 'results', hubspot_convert)),
+        ('items.serialize', lambda: serialize_items(items)),
+        ('items.serialize_lines', lambda: serialize_item_lines(items)),
+        ('items.deserialize', lambda: deserialize_items(payload))
+    ]
+
+
+def run(scales, repeat):
+    """Return {case@scale: ns per item} for every case and scale."""
+    results = {}
+    for n in scales:
+        for name, fn in _cases(n):
+            number = max(1, 100_000 // n)
+            best = min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+            results[f'{name}@{n}'] = round(best / n * 1e9, 1)
+            print(f'{name:<24} n={n:<7} {results[f"{name}@{n}"]:>10.1f} ns/item')
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print per-case changes against a baseline and return the regressions."""
+    regressions = []
+    for key, value in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        change = value / previous - 1
+        marker = ' REGRESSION' if change > threshold else ''
+        print(f'{key:<32} {previous:>10.1f} -> {value:>10.1f} ns/item ({change:+.0%}){marker}')
+        if change > threshold:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', default=','.join(map(str, _DEFAULT_SCALES)),
+                        help='comma separated item counts')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', action='store_true', help='write results to the baseline file')
+    parser.add_argument('--compare', action='store_true', help='compare results with the baseline file')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed per-item slowdown before failing --compare')
+    parser.add_argument('--baseline', default=_BASELINE_PATH)
+    args = parser.parse_args()
+
+    results = run([int(n) for n in args.scales.split(',')], args.repeat)
+
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': results
+            }, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
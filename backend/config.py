@@ -7,15 +7,118 @@ _base_url = 'http://localhost:8000/integrations'
 
 redis = {
     'host': os.getenv('REDIS_HOST', 'localhost'),
-    'port': int(os.getenv('REDIS_PORT', 6379))
+    'port': int(os.getenv('REDIS_PORT', 6379)),
+    'max_connections': int(os.getenv('REDIS_MAX_CONNECTIONS', 50)),
+    'health_check_interval': int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30)),
+    'socket_timeout': float(os.getenv('REDIS_SOCKET_TIMEOUT', 5.0)),
+    'socket_connect_timeout': float(os.getenv('REDIS_SOCKET_CONNECT_TIMEOUT', 5.0))
+}
+
+http = {
+    'max_connections': int(os.getenv('HTTP_MAX_CONNECTIONS', 100)),
+    'max_keepalive_connections': int(os.getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', 20)),
+    'keepalive_expiry': float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 30.0)),
+    'http2': os.getenv('HTTP_HTTP2', 'false').lower() == 'true',
+    'timeout': float(os.getenv('HTTP_TIMEOUT', 30.0)),
+    'connect_timeout': float(os.getenv('HTTP_CONNECT_TIMEOUT', 10.0))
+}
+
+# Token buckets per provider and access token: `rate` requests per second
+# with up to `burst` sent back to back, kept under each provider's ceiling
+rate_limits = {
+    'airtable': {
+        'rate': float(os.getenv('AIRTABLE_RATE_LIMIT', 5.0)),
+        'burst': int(os.getenv('AIRTABLE_RATE_BURST', 1))
+    },
+    'notion': {
+        'rate': float(os.getenv('NOTION_RATE_LIMIT', 3.0)),
+        'burst': int(os.getenv('NOTION_RATE_BURST', 1))
+    },
+    'hubspot': {
+        'rate': float(os.getenv('HUBSPOT_RATE_LIMIT', 9.0)),
+        'burst': int(os.getenv('HUBSPOT_RATE_BURST', 10))
+    },
+    # OAuth code exchanges and token refreshes, one bucket per provider
+    'oauth': {
+        'rate': float(os.getenv('OAUTH_RATE_LIMIT', 20.0)),
+        'burst': int(os.getenv('OAUTH_RATE_BURST', 20))
+    },
+    'max_retries': int(os.getenv('RATE_LIMIT_MAX_RETRIES', 5)),
+    'backoff_base': float(os.getenv('RATE_LIMIT_BACKOFF_BASE', 0.5)),
+    'backoff_max': float(os.getenv('RATE_LIMIT_BACKOFF_MAX', 30.0)),
+    'jitter': float(os.getenv('RATE_LIMIT_JITTER', 0.5))
+}
+
+cache = {
+    # Seconds to keep /load results per provider; 0 disables caching
+    'ttl': {
+        'airtable': int(os.getenv('CACHE_TTL_AIRTABLE', 300)),
+        'notion': int(os.getenv('CACHE_TTL_NOTION', 300)),
+        'hubspot': int(os.getenv('CACHE_TTL_HUBSPOT', 300))
+    },
+    'compress_level': int(os.getenv('CACHE_COMPRESS_LEVEL', 6)),
+    # Seconds to keep incremental sync snapshots and watermarks
+    'snapshot_ttl': int(os.getenv('SYNC_SNAPSHOT_TTL', 7 * 24 * 3600)),
+    # Seconds between full fetches of watermark-synced providers, so deleted
+    # and archived objects drop out of the snapshot; 0 disables them
+    'full_sync_interval': int(os.getenv('SYNC_FULL_INTERVAL', 24 * 3600)),
+    # Fetch and cache a user's items in the background once OAuth completes
+    'prefetch': os.getenv('CACHE_PREFETCH', 'true').lower() == 'true',
+    # Hierarchy indexes kept in memory per worker, each for its provider's TTL
+    'index_size': int(os.getenv('HIERARCHY_CACHE_SIZE', 64)),
+    # Items of filtered and sorted /load results kept in memory per worker
+    'query_items': int(os.getenv('QUERY_CACHE_ITEMS', 500_000))
+}
+
+# Decoding of large upstream pages off the event loop
+offload = {
+    # 'thread', 'process' or 'none' to decode every page on the event loop
+    'executor': os.getenv('OFFLOAD_EXECUTOR', 'thread'),
+    'workers': int(os.getenv('OFFLOAD_WORKERS', 2)),
+    # Pages with bodies of at least this many bytes are handed to the executor
+    'threshold_bytes': int(os.getenv('OFFLOAD_THRESHOLD_BYTES', 256 * 1024)),
+    # Seconds between event loop lag samples (0 disables), and the lag to warn above
+    'lag_interval': float(os.getenv('LOOP_LAG_INTERVAL', 0.5)),
+    'lag_target': float(os.getenv('LOOP_LAG_TARGET', 0.05))
+}
+
+# In-memory search over synced snapshots
+search = {
+    # Per-user provider indexes kept in memory per worker
+    'index_size': int(os.getenv('SEARCH_INDEX_SIZE', 16)),
+    # Sorted candidate keys cached per index for repeated narrower terms
+    'ordered_entries': int(os.getenv('SEARCH_ORDERED_ENTRIES', 200_000)),
+    'default_limit': int(os.getenv('SEARCH_DEFAULT_LIMIT', 20)),
+    'max_limit': int(os.getenv('SEARCH_MAX_LIMIT', 100))
+}
+
+# Coalescing of identical concurrent /load requests across workers
+singleflight = {
+    'lock_ttl': int(os.getenv('SINGLEFLIGHT_LOCK_TTL', 60)),
+    'result_ttl': int(os.getenv('SINGLEFLIGHT_RESULT_TTL', 10)),
+    'poll_interval': float(os.getenv('SINGLEFLIGHT_POLL_INTERVAL', 0.05)),
+    'wait_timeout': float(os.getenv('SINGLEFLIGHT_WAIT_TIMEOUT', 300))
+}
+
+# Server-side OAuth credential store
+credentials = {
+    # Comma separated Fernet keys; the first encrypts, all decrypt (for rotation)
+    'encryption_keys': os.getenv('CREDENTIALS_ENCRYPTION_KEYS', ''),
+    'ttl': int(os.getenv('CREDENTIALS_TTL', 30 * 24 * 3600)),
+    # Refresh access tokens this many seconds before they expire
+    'refresh_margin': int(os.getenv('CREDENTIALS_REFRESH_MARGIN', 300)),
+    # Seconds between background refresh sweeps; 0 disables the sweeper
+    'refresh_interval': float(os.getenv('CREDENTIALS_REFRESH_INTERVAL', 60)),
+    'refresh_batch': int(os.getenv('CREDENTIALS_REFRESH_BATCH', 100)),
+    'lock_ttl': int(os.getenv('CREDENTIALS_REFRESH_LOCK_TTL', 30))
 }
 
 hubspot = {
     'client_id': os.getenv('HUBSPOT_CLIENT_ID'),
     'client_secret': os.getenv('HUBSPOT_CLIENT_SECRET'),
     'auth_url': 'https://app.hubspot.com/oauth/authorize',
-    'token_url': 'https://api.hubapi.com/oauth/v1/token',
-    'api_base_url': 'https://api.hubapi.com',
+    'token_url': os.getenv('HUBSPOT_TOKEN_URL', 'https://api.hubapi.com/oauth/v1/token'),
+    'api_base_url': os.getenv('HUBSPOT_API_BASE_URL', 'https://api.hubapi.com'),
     'redirect_uri': f'{_base_url}/hubspot/oauth2callback',
     'scopes': 'crm.objects.contacts.read%20crm.objects.contacts.write%20crm.objects.companies.read%20crm.objects.companies.write%20oauth'
 }
@@ -25,8 +128,8 @@ notion = {
     'client_secret': os.getenv('NOTION_CLIENT_SECRET'),
     'redirect_uri': f'{_base_url}/notion/oauth2callback',
     'auth_url': 'https://api.notion.com/v1/oauth/authorize',
-    'token_url': 'https://api.notion.com/v1/oauth/token',
-    'api_base_url': 'https://api.notion.com/v1',
+    'token_url': os.getenv('NOTION_TOKEN_URL', 'https://api.notion.com/v1/oauth/token'),
+    'api_base_url': os.getenv('NOTION_API_BASE_URL', 'https://api.notion.com/v1'),
     'api_version': '2022-06-28'
 }
 
@@ -35,7 +138,9 @@ airtable = {
     'client_secret': os.getenv('AIRTABLE_CLIENT_SECRET'),
     'redirect_uri': f'{_base_url}/airtable/oauth2callback',
     'auth_url': 'https://airtable.com/oauth2/v1/authorize',
-    'token_url': 'https://api.airtable.com/oauth2/v1/token',
-    'api_base_url': 'https://api.airtable.com/v0',
+    'token_url': os.getenv('AIRTABLE_TOKEN_URL', 'https://api.airtable.com/oauth2/v1/token'),
+    'api_base_url': os.getenv('AIRTABLE_API_BASE_URL', 'https://api.airtable.com/v0'),
+    'table_concurrency': int(os.getenv('AIRTABLE_TABLE_CONCURRENCY', 5)),
+    'record_concurrency': int(os.getenv('AIRTABLE_RECORD_CONCURRENCY', 5)),
     'scopes': 'data.records:read%20data.records:write%20data.recordComments:read%20data.recordComments:write%20schema.bases:read%20schema.bases:write'
 }
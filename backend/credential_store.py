@@ -0,0 +1,209 @@
+import asyncio
+import json
+import logging
+import secrets
+import time
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from fastapi import HTTPException
+
+import providers
+import redis_client
+from config import credentials as credentials_config
+
+logger = logging.getLogger(__name__)
+
+# Sorted set of stored credentials with refresh tokens, scored by expiry time
+_EXPIRY_KEY = 'credentials_expiry'
+
+_fernet = None
+
+
+class CredentialsNotFound(HTTPException):
+    """Raised when a user has no usable stored credentials for a provider."""
+
+    def __init__(self):
+        super().__init__(status_code=400, detail='No credentials found.')
+
+
+def _get_fernet():
+    global _fernet
+    if _fernet is None:
+        keys = [key.strip() for key in credentials_config['encryption_keys'].split(',') if key.strip()]
+        if not keys:
+            raise RuntimeError('CREDENTIALS_ENCRYPTION_KEYS is not set')
+        _fernet = MultiFernet([Fernet(key) for key in keys])
+    return _fernet
+
+
+def check_keys():
+    """Raise unless usable encryption keys are configured.
+
+    Run at startup, so a missing or malformed key stops the app rather than
+    failing the first OAuth callback after its code was already exchanged.
+    """
+    _get_fernet()
+
+
+def _credentials_key(provider, org_id, user_id):
+    return f'credentials:{provider}:{org_id}:{user_id}'
+
+
+def _expiry_member(provider, org_id, user_id):
+    # JSON keeps ids containing ':' unambiguous
+    return json.dumps([provider, org_id, user_id])
+
+
+def _is_due(record):
+    """Check whether a refreshable token expires within the refresh margin."""
+    if not record.get('refresh_token') or record.get('expires_at') is None:
+        return False
+    return record['expires_at'] - credentials_config['refresh_margin'] <= time.time()
+
+
+async def save(provider, org_id, user_id, token, keep_ttl=False):
+    """Encrypt and store a provider token response, scheduling its refresh.
+
+    Returns the stored record, which adds an absolute ``expires_at`` to the
+    token response when it has ``expires_in``.
+    """
+    record = dict(token)
+    expires_in = record.get('expires_in')
+    record['expires_at'] = time.time() + float(expires_in) if expires_in else None
+
+    await redis_client.add_key_value(
+        _credentials_key(provider, org_id, user_id),
+        _get_fernet().encrypt(json.dumps(record).encode('utf-8')),
+        expire=None if keep_ttl else credentials_config['ttl'],
+        keep_ttl=keep_ttl
+    )
+    member = _expiry_member(provider, org_id, user_id)
+    refreshable = providers.get_handler(provider, 'refresh_token') is not None
+    if refreshable and record.get('refresh_token') and record['expires_at'] is not None:
+        await redis_client.add_to_sorted_set(_EXPIRY_KEY, member, record['expires_at'])
+    else:
+        await redis_client.remove_from_sorted_set(_EXPIRY_KEY, member)
+    return record
+
+
+async def _load(provider, org_id, user_id):
+    payload = await redis_client.get_value(_credentials_key(provider, org_id, user_id))
+    if payload is None:
+        return None
+    try:
+        return json.loads(_get_fernet().decrypt(payload))
+    except InvalidToken:
+        logger.warning('Stored %s credentials for org %s user %s could not be decrypted',
+                       provider, org_id, user_id)
+        return None
+
+
+async def delete(provider, org_id, user_id):
+    """Forget a user's stored credentials."""
+    await redis_client.delete_key(_credentials_key(provider, org_id, user_id))
+    await redis_client.remove_from_sorted_set(_EXPIRY_KEY, _expiry_member(provider, org_id, user_id))
+
+
+async def refresh(provider, org_id, user_id, wait=True):
+    """Exchange a stored refresh token for a new access token if it is due.
+
+    A Redis lock keeps workers from spending the same refresh token twice. A
+    caller that loses the race waits for the winner (or, with ``wait=False``,
+    gives up) and returns the reread record. Credentials whose refresh token
+    is rejected are deleted, and None is returned.
+    """
+    lock_key = f'credentials_refresh:{provider}:{org_id}:{user_id}'
+    lock_token = secrets.token_hex(16)
+    deadline = time.monotonic() + credentials_config['lock_ttl']
+    while not await redis_client.acquire_lock(lock_key, lock_token, credentials_config['lock_ttl']):
+        if not wait:
+            return None
+        if time.monotonic() >= deadline:
+            raise HTTPException(status_code=503, detail='Timed out waiting for a credential refresh.')
+        await asyncio.sleep(0.1)
+
+    try:
+        # Another worker may have refreshed while we waited for the lock
+        record = await _load(provider, org_id, user_id)
+        if record is None:
+            # Expired or undecryptable; stop scheduling refreshes for it
+            await redis_client.remove_from_sorted_set(
+                _EXPIRY_KEY, _expiry_member(provider, org_id, user_id)
+            )
+            return None
+        refresh_token = providers.get_handler(provider, 'refresh_token')
+        if refresh_token is None or not _is_due(record):
+            return record
+
+        try:
+            token = await refresh_token(record['refresh_token'])
+        except HTTPException as e:
+            if e.status_code not in (400, 401):
+                raise
+            logger.warning('%s rejected the refresh token for org %s user %s; deleting credentials',
+                           provider, org_id, user_id)
+            await delete(provider, org_id, user_id)
+            return None
+
+        # Providers that do not rotate refresh tokens omit them from the response
+        token.setdefault('refresh_token', record['refresh_token'])
+        return await save(provider, org_id, user_id, token, keep_ttl=True)
+    finally:
+        await redis_client.release_lock(lock_key, lock_token)
+
+
+async def get_credentials(provider, org_id, user_id):
+    """Return a user's stored access credentials without the refresh token.
+
+    Tokens within the refresh margin are refreshed first. If that refresh
+    fails but the current token has not yet expired, the current token is used.
+    """
+    record = await _load(provider, org_id, user_id)
+    if record is not None and _is_due(record):
+        try:
+            record = await refresh(provider, org_id, user_id)
+        except Exception as e:
+            if record['expires_at'] <= time.time():
+                raise
+            logger.warning('Refreshing %s credentials failed, using the current token: %s', provider, e)
+    if record is None:
+        raise CredentialsNotFound()
+
+    record.pop('refresh_token', None)
+    return record
+
+
+async def get_status(provider, org_id, user_id):
+    """Return that a user's provider is connected and when its token expires.
+
+    The token itself is not returned: loads given ``user_id``/``org_id``
+    use the stored credentials directly.
+    """
+    record = await get_credentials(provider, org_id, user_id)
+    return {'connected': True, 'expires_at': record['expires_at']}
+
+
+async def refresh_due_credentials():
+    """Refresh stored tokens that expire within the refresh margin."""
+    members = await redis_client.get_sorted_set_range(
+        _EXPIRY_KEY,
+        time.time() + credentials_config['refresh_margin'],
+        credentials_config['refresh_batch']
+    )
+    for member in members:
+        provider, org_id, user_id = json.loads(member)
+        try:
+            await refresh(provider, org_id, user_id, wait=False)
+        except Exception as e:
+            logger.warning('Refreshing %s credentials for org %s user %s failed: %s',
+                           provider, org_id, user_id, e)
+
+
+async def run_refresher():
+    """Refresh expiring tokens every refresh_interval seconds until cancelled."""
+    while True:
+        try:
+            await refresh_due_credentials()
+        except Exception as e:
+            logger.warning('Credential refresh sweep failed: %s', e)
+        await asyncio.sleep(credentials_config['refresh_interval'])
@@ -0,0 +1,68 @@
+from collections import deque
+
+from fastapi import HTTPException
+
+
+class HierarchyIndex:
+    """Parent to children adjacency over one load result."""
+
+    __slots__ = ('items', 'children', 'roots')
+
+    def __init__(self, items, children, roots):
+        self.items = items
+        self.children = children
+        self.roots = roots
+
+
+def build_index(items):
+    """Index items by id and fill each item's ``children`` in one pass.
+
+    Items whose parent is not part of the result are treated as roots. Ids
+    must be unique across the result, so providers whose object ids repeat
+    across types suffix them with the type.
+    """
+    by_id = {}
+    children = {}
+    for item in items:
+        by_id[item.id] = item
+        if item.parent_id is not None:
+            children.setdefault(item.parent_id, []).append(item.id)
+
+    roots = []
+    for item in items:
+        item.children = children.get(item.id)
+        if item.parent_id is None or item.parent_id not in by_id:
+            roots.append(item.id)
+    return HierarchyIndex(by_id, children, roots)
+
+
+def subtree(index, item_id=None, depth=1):
+    """Return an item and its descendants up to ``depth`` levels below it.
+
+    Without ``item_id`` the walk starts from every root. Items are returned
+    breadth first, and ``children`` always lists every child id so clients
+    know which branches they can expand further.
+    """
+    if depth < 0:
+        raise HTTPException(status_code=400, detail='depth must not be negative.')
+    if item_id is None:
+        start = index.roots
+    elif item_id in index.items:
+        start = [item_id]
+    else:
+        raise HTTPException(status_code=404, detail='Item not found.')
+
+    result = []
+    seen = set(start)
+    queue = deque((root_id, 0) for root_id in start)
+    while queue:
+        current, level = queue.popleft()
+        result.append(index.items[current])
+        if level == depth:
+            continue
+        for child_id in index.children.get(current, ()):
+            # Guards against cycles in malformed provider data
+            if child_id not in seen:
+                seen.add(child_id)
+                queue.append((child_id, level + 1))
+    return result
@@ -0,0 +1,53 @@
+import httpx
+from config import http as http_config
+
+_clients = {}
+
+
+def _http2_available():
+    """Check whether the optional h2 package required for HTTP/2 is installed."""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _create_client():
+    """Create a pooled AsyncClient from the HTTP config."""
+    limits = httpx.Limits(
+        max_connections=http_config['max_connections'],
+        max_keepalive_connections=http_config['max_keepalive_connections'],
+        keepalive_expiry=http_config['keepalive_expiry']
+    )
+    timeout = httpx.Timeout(
+        http_config['timeout'],
+        connect=http_config['connect_timeout']
+    )
+    return httpx.AsyncClient(
+        limits=limits,
+        timeout=timeout,
+        http2=http_config['http2'] and _http2_available()
+    )
+
+
+def get_client(provider):
+    """Return the shared client for a provider, creating it on first use."""
+    client = _clients.get(provider)
+    if client is None or client.is_closed:
+        client = _clients[provider] = _create_client()
+    return client
+
+
+def start_clients(providers):
+    """Create the shared clients for the given providers."""
+    for provider in providers:
+        get_client(provider)
+
+
+async def close_clients():
+    """Close every shared client and release pooled connections."""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
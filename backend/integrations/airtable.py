@@ -7,10 +7,19 @@ import httpx
 import asyncio
 import base64
 import hashlib
-import requests
+import orjson
 from integrations.integration_item import IntegrationItem
+import credential_store
+import json_stream
+import loader
+import offload
+import rate_limiter
 import redis_client
+import streaming
 from config import airtable
+import metrics
+
+_RECORD_PAGE_SIZE = 100
 
 
 def _get_encoded_client_credentials():
@@ -62,23 +71,18 @@ async def authorize_airtable(user_id, org_id):
     code_verifier, code_challenge = _generate_code_challenge()
     auth_url = _get_auth_url(encoded_state, code_challenge)
 
-    await asyncio.gather(
-        redis_client.add_key_value(
-            f'airtable_state:{org_id}:{user_id}',
-            json.dumps(state_data),
-            expire=600
-        ),
-        redis_client.add_key_value(
-            f'airtable_verifier:{org_id}:{user_id}',
-            code_verifier,
-            expire=600
-        )
+    await redis_client.mset_with_ttl(
+        {
+            f'airtable_state:{org_id}:{user_id}': json.dumps(state_data),
+            f'airtable_verifier:{org_id}:{user_id}': code_verifier
+        },
+        expire=600
     )
 
     return auth_url
 
 
-def _get_close_window_response():
+def _get_close_window_response(background=None):
     """Return HTML response to close the OAuth window."""
     return HTMLResponse(content="""
         <html>
@@ -86,7 +90,7 @@ def _get_close_window_response():
                 window.close();
             </script>
         </html>
-    """)
+    """, background=background)
 
 
 async def oauth2callback_airtable(request: Request):
@@ -107,9 +111,13 @@ async def oauth2callback_airtable(request: Request):
     org_id = state_data.get('org_id')
     original_state = state_data.get('state')
 
-    saved_state, code_verifier = await asyncio.gather(
-        redis_client.get_value(f'airtable_state:{org_id}:{user_id}'),
-        redis_client.get_value(f'airtable_verifier:{org_id}:{user_id}')
+    # State and verifier are single use, so read and delete them together
+    saved_state, code_verifier = await redis_client.mget(
+        [
+            f'airtable_state:{org_id}:{user_id}',
+            f'airtable_verifier:{org_id}:{user_id}'
+        ],
+        delete=True
     )
 
     if not saved_state or original_state != json.loads(saved_state).get('state'):
@@ -117,46 +125,58 @@ async def oauth2callback_airtable(request: Request):
 
     encoded_credentials = _get_encoded_client_credentials()
 
-    async with httpx.AsyncClient() as client:
-        response, _, _ = await asyncio.gather(
-            client.post(
-                airtable['token_url'],
-                data={
-                    'grant_type': 'authorization_code',
-                    'code': code,
-                    'redirect_uri': airtable['redirect_uri'],
-                    'client_id': airtable['client_id'],
-                    'code_verifier': code_verifier.decode('utf-8')
-                },
-                headers={
-                    'Authorization': f'Basic {encoded_credentials}',
-                    'Content-Type': 'application/x-www-form-urlencoded'
-                }
-            ),
-            redis_client.delete_key(f'airtable_state:{org_id}:{user_id}'),
-            redis_client.delete_key(f'airtable_verifier:{org_id}:{user_id}')
-        )
+    response = await rate_limiter.request(
+        'airtable',
+        'POST',
+        airtable['token_url'],
+        data={
+            'grant_type': 'authorization_code',
+            'code': code,
+            'redirect_uri': airtable['redirect_uri'],
+            'client_id': airtable['client_id'],
+            'code_verifier': code_verifier.decode('utf-8')
+        },
+        headers={
+            'Authorization': f'Basic {encoded_credentials}',
+            'Content-Type': 'application/x-www-form-urlencoded'
+        }
+    )
 
-    await redis_client.add_key_value(
-        f'airtable_credentials:{org_id}:{user_id}',
-        json.dumps(response.json()),
-        expire=600
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=response.text)
+
+    token = response.json()
+    await credential_store.save('airtable', org_id, user_id, token)
+
+    return _get_close_window_response(
+        loader.prefetch_task('airtable', json.dumps(token), get_items_airtable)
     )
 
-    return _get_close_window_response()
 
+async def refresh_airtable_token(refresh_token):
+    """Exchange an Airtable refresh token for a new token response."""
+    response = await rate_limiter.request(
+        'airtable',
+        'POST',
+        airtable['token_url'],
+        data={
+            'grant_type': 'refresh_token',
+            'refresh_token': refresh_token,
+            'client_id': airtable['client_id']
+        },
+        headers={
+            'Authorization': f'Basic {_get_encoded_client_credentials()}',
+            'Content-Type': 'application/x-www-form-urlencoded'
+        }
+    )
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=response.text)
+    return response.json()
 
-async def get_airtable_credentials(user_id, org_id):
-    """Retrieve Airtable credentials from Redis."""
-    credentials = await redis_client.get_value(f'airtable_credentials:{org_id}:{user_id}')
-    
-    if not credentials:
-        raise HTTPException(status_code=400, detail='No credentials found.')
-    
-    credentials = json.loads(credentials)
-    await redis_client.delete_key(f'airtable_credentials:{org_id}:{user_id}')
 
-    return credentials
+async def get_airtable_credentials(user_id, org_id):
+    """Return the connection status of stored Airtable credentials, refreshing them if needed."""
+    return await credential_store.get_status('airtable', org_id, user_id)
 
 
 def _create_integration_item_metadata_object(
@@ -177,84 +197,208 @@ def _create_integration_item_metadata_object(
     )
 
 
-async def _fetch_items(access_token: str, url: str, aggregated_response: list, offset=None):
-    """Fetch items from Airtable API with pagination."""
-    params = {'offset': offset} if offset is not None else {}
+@metrics.counted_pages('airtable')
+async def _fetch_bases(access_token: str):
+    """Yield pages of Airtable bases, following the offset cursor."""
+    url = f"{airtable['api_base_url']}/meta/bases"
     headers = {'Authorization': f'Bearer {access_token}'}
-    
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, headers=headers, params=params)
+    params = {}
+
+    while True:
+        async with rate_limiter.stream(
+            'airtable', 'GET', url, access_token, headers=headers, params=params
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise HTTPException(
+                    status_code=response.status_code,
+                    detail=response.text
+                )
+            bases, fields = await json_stream.read_array(
+                'airtable', response, 'bases', ['offset']
+            )
+        yield bases
 
-    if response.status_code != 200:
-        return
+        offset = fields['offset']
+        if offset is None:
+            break
+        params = {'offset': offset}
 
-    data = response.json()
-    results = data.get('bases', {})
-    offset = data.get('offset')
 
-    aggregated_response.extend(results)
+def _get_table_summary(table):
+    """Keep only what items and record fetches use from a table schema.
 
-    if offset is not None:
-        await _fetch_items(access_token, url, aggregated_response, offset)
+    Schemas carry every field's options and can run to megabytes.
+    """
+    return {'id': table['id'], 'name': table.get('name'), 'primaryFieldId': table.get('primaryFieldId')}
 
 
-async def _fetch_tables_for_base(client: httpx.AsyncClient, base: dict, access_token: str) -> list[IntegrationItem]:
-    """Fetch tables for a specific base."""
-    tables_url = f"{airtable['api_base_url']}/meta/bases/{base.get('id')}/tables"
-    response = await client.get(
+async def _get_tables(base_id, access_token):
+    """Fetch the tables of a base.
+
+    Failures raise rather than return no tables, which syncs would take as
+    every table of the base having been deleted.
+    """
+    tables_url = f"{airtable['api_base_url']}/meta/bases/{base_id}/tables"
+    # Airtable rate limits each base separately
+    async with rate_limiter.stream(
+        'airtable',
+        'GET',
         tables_url,
+        access_token,
+        scope=base_id,
         headers={'Authorization': f'Bearer {access_token}'}
-    )
-    
-    items = []
-    if response.status_code == 200:
-        tables = response.json()['tables']
-        items.extend([
-            _create_integration_item_metadata_object(
-                table,
-                'Table',
-                base.get('id'),
-                base.get('name')
+    ) as response:
+        if response.status_code != 200:
+            await response.aread()
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=response.text
             )
-            for table in tables
-        ])
-    return items
+        tables, _ = await json_stream.read_array(
+            'airtable', response, 'tables', convert=_get_table_summary
+        )
+    metrics.count_page('airtable')
+    return tables
 
 
-async def get_items_airtable(credentials) -> list[IntegrationItem]:
-    """Fetch and process items from Airtable."""
-    print(credentials)
+async def _fetch_tables_for_base(base: dict, access_token: str) -> list[IntegrationItem]:
+    """Fetch tables for a specific base."""
+    return [
+        _create_integration_item_metadata_object(
+            table,
+            'Table',
+            base.get('id'),
+            base.get('name')
+        )
+        for table in await _get_tables(base.get('id'), access_token)
+    ]
+
 
+async def iter_items_airtable(credentials):
+    """Yield pages of Airtable items as bases and their tables are fetched."""
     credentials = json.loads(credentials)
     access_token = credentials.get('access_token')
-    url = f"{airtable['api_base_url']}/meta/bases"
-    
-    bases = []
-    await _fetch_items(access_token, url, bases)
-    
-    items = []
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        try:
-            # Create base items
-            base_items = [
+
+    semaphore = asyncio.Semaphore(airtable['table_concurrency'])
+    table_tasks = []
+
+    async def _fetch_tables(base):
+        async with semaphore:
+            return await _fetch_tables_for_base(base, access_token)
+
+    try:
+        async for bases in _fetch_bases(access_token):
+            yield [
                 _create_integration_item_metadata_object(base, 'Base')
                 for base in bases
             ]
-            items.extend(base_items)
-            
-            # Fetch tables for all bases concurrently
-            table_tasks = [
-                _fetch_tables_for_base(client, base, access_token)
+            # Start table fetches while later pages of bases are still loading
+            table_tasks.extend(
+                asyncio.create_task(_fetch_tables(base))
                 for base in bases
-            ]
-            table_results = await asyncio.gather(*table_tasks)
-            
-            # Extend items with all table results
-            for table_items in table_results:
-                items.extend(table_items)
-        except httpx.TimeoutException:
-            raise HTTPException(status_code=504, detail='Request to Airtable timed out')
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=500, detail=f'Failed to connect to Airtable: {str(e)}')
-
-    return items
+            )
+
+        for task in table_tasks:
+            yield await task
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail='Request to Airtable timed out')
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=500, detail=f'Failed to connect to Airtable: {str(e)}')
+    finally:
+        for task in table_tasks:
+            task.cancel()
+
+
+async def get_items_airtable(credentials) -> list[IntegrationItem]:
+    """Fetch and process items from Airtable."""
+    return [item async for items in iter_items_airtable(credentials) for item in items]
+
+
+def _create_record_item(record, table):
+    """Create a compact IntegrationItem for a record, named by its primary field."""
+    name = record.get('fields', {}).get(table['primaryFieldId'])
+    return IntegrationItem(
+        id=f"{record['id']}_Record",
+        name=name if name is None or isinstance(name, str) else str(name),
+        type='Record',
+        parent_id=f"{table['id']}_Table",
+        parent_path_or_name=table.get('name'),
+        creation_time=record.get('createdTime')
+    )
+
+
+def _convert_records(content, table):
+    """Decode a page of records into record items and the next offset."""
+    data = orjson.loads(content)
+    items = [_create_record_item(record, table) for record in data.get('records', [])]
+    return items, data.get('offset')
+
+
+@metrics.counted_pages('airtable')
+async def _fetch_records(base_id, table, access_token):
+    """Yield pages of a table's record items, fetching only the primary field."""
+    url = f"{airtable['api_base_url']}/{base_id}/{table['id']}"
+    headers = {'Authorization': f'Bearer {access_token}'}
+    params = {
+        'pageSize': _RECORD_PAGE_SIZE,
+        'fields[]': table['primaryFieldId'],
+        'returnFieldsByFieldId': 'true'
+    }
+
+    while True:
+        response = await rate_limiter.request(
+            'airtable', 'GET', url, access_token, scope=base_id, headers=headers, params=params
+        )
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=response.text
+            )
+
+        items, offset = await offload.decode('airtable', _convert_records, response.content, table)
+        yield items
+
+        if offset is None:
+            break
+        params = {**params, 'offset': offset}
+
+
+async def _iter_base_tables(base_id, access_token):
+    # A failed schema fetch raises, ending the record stream with an error
+    for table in await _get_tables(base_id, access_token):
+        yield base_id, table
+
+
+async def _iter_tables(access_token):
+    """Yield (base id, table schema) pairs, fetching several bases' schemas at once."""
+    bases = (
+        _iter_base_tables(base['id'], access_token)
+        async for page in _fetch_bases(access_token)
+        for base in page
+    )
+    async for base_table in streaming.merge_bounded(bases, airtable['table_concurrency']):
+        yield base_table
+
+
+async def iter_records_airtable(credentials):
+    """Yield pages of Airtable record items, streaming several tables at once.
+
+    At most ``record_concurrency`` tables are paged concurrently and only one
+    page per table is held at a time, so memory stays bounded however many
+    records the bases hold. A base schema or record page that cannot be
+    fetched raises rather than leaving its tables out of the stream.
+    """
+    access_token = json.loads(credentials).get('access_token')
+    tables = (
+        _fetch_records(base_id, table, access_token)
+        async for base_id, table in _iter_tables(access_token)
+    )
+
+    try:
+        async for items in streaming.merge_bounded(tables, airtable['record_concurrency']):
+            yield items
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail='Request to Airtable timed out')
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=500, detail=f'Failed to connect to Airtable: {str(e)}')
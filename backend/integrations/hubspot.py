@@ -1,18 +1,49 @@
 import json
 import datetime
+import logging
 import secrets
 from fastapi import Request, HTTPException
 from fastapi.responses import HTMLResponse
 import httpx
 import asyncio
 import base64
-import requests
+import functools
 from integrations.integration_item import IntegrationItem
+import credential_store
+import json_stream
+import loader
+import rate_limiter
 import redis_client
+import streaming
 from config import hubspot
+import metrics
 
+logger = logging.getLogger(__name__)
 
-def _get_close_window_response():
+_PAGE_LIMIT = 100
+
+# HubSpot search returns at most this many results per query, however paged
+_SEARCH_RESULT_LIMIT = 10_000
+
+_OBJECT_PATHS = {
+    'contact': 'contacts',
+    'company': 'companies'
+}
+
+# Only the properties read by _get_item_name are requested
+_OBJECT_PROPERTIES = {
+    'contact': ['firstname', 'lastname', 'name'],
+    'company': ['name']
+}
+
+# Last-modified property each object type can be searched by
+_MODIFIED_PROPERTIES = {
+    'contact': 'lastmodifieddate',
+    'company': 'hs_lastmodifieddate'
+}
+
+
+def _get_close_window_response(background=None):
     """Return HTML response to close the OAuth window."""
     return HTMLResponse(content="""
         <html>
@@ -20,7 +51,7 @@ def _get_close_window_response():
                 window.close();
             </script>
         </html>
-    """)
+    """, background=background)
 
 
 def _create_state_data(user_id, org_id):
@@ -67,7 +98,7 @@ async def oauth2callback_hubspot(request: Request):
     if request.query_params.get('error'):
         error = request.query_params.get('error')
         error_description = request.query_params.get('error_description')
-        print(f"OAuth error: {error} - {error_description}")
+        logger.warning("HubSpot OAuth error: %s - %s", error, error_description)
         raise HTTPException(
             status_code=400,
             detail=error_description or error
@@ -77,7 +108,7 @@ async def oauth2callback_hubspot(request: Request):
     encoded_state = request.query_params.get('state')
     
     if not code or not encoded_state:
-        print("Missing code or state in callback")
+        logger.warning("HubSpot callback is missing code or state")
         raise HTTPException(
             status_code=400,
             detail="Missing required parameters: code or state"
@@ -88,7 +119,7 @@ async def oauth2callback_hubspot(request: Request):
             base64.urlsafe_b64decode(encoded_state).decode('utf-8')
         )
     except Exception as e:
-        print(f"Failed to decode state: {str(e)}")
+        logger.warning("Failed to decode HubSpot state: %s", e)
         raise HTTPException(
             status_code=400,
             detail="Invalid state parameter"
@@ -99,75 +130,79 @@ async def oauth2callback_hubspot(request: Request):
     original_state = state_data.get('state')
 
     if not all([user_id, org_id, original_state]):
-        print("Missing required state data:", state_data)
+        logger.warning("HubSpot state is missing user_id, org_id or state")
         raise HTTPException(
             status_code=400,
             detail="Invalid state data"
         )
 
-    saved_state = await redis_client.get_value(f'hubspot_state:{org_id}:{user_id}')
-    print("Saved state from Redis:", saved_state)
+    saved_state = await redis_client.get_and_delete_value(f'hubspot_state:{org_id}:{user_id}')
 
     if not saved_state:
-        print("No saved state found in Redis")
+        logger.warning("No saved HubSpot state for org %s user %s", org_id, user_id)
         raise HTTPException(status_code=400, detail='State not found in Redis')
 
     saved_state_data = json.loads(saved_state)
     if original_state != saved_state_data.get('state'):
-        print("State mismatch:", {
-            "original": original_state,
-            "saved": saved_state_data.get('state')
-        })
+        logger.warning("HubSpot state mismatch for org %s user %s", org_id, user_id)
         raise HTTPException(status_code=400, detail='State does not match.')
 
     try:
-        async with httpx.AsyncClient() as client:
-            token_response = await client.post(
-                hubspot['token_url'],
-                data={
-                    'grant_type': 'authorization_code',
-                    'client_id': hubspot['client_id'],
-                    'client_secret': hubspot['client_secret'],
-                    'redirect_uri': hubspot['redirect_uri'],
-                    'code': code
-                }
+        token_response = await rate_limiter.request(
+            'hubspot',
+            'POST',
+            hubspot['token_url'],
+            data={
+                'grant_type': 'authorization_code',
+                'client_id': hubspot['client_id'],
+                'client_secret': hubspot['client_secret'],
+                'redirect_uri': hubspot['redirect_uri'],
+                'code': code
+            }
+        )
+        if token_response.status_code != 200:
+            logger.warning("HubSpot token exchange returned %s", token_response.status_code)
+            raise HTTPException(
+                status_code=token_response.status_code,
+                detail=token_response.text
             )
-            print("Token response status:", token_response.status_code)
-            print("Token response:", token_response.text)
-
-            if token_response.status_code != 200:
-                raise HTTPException(
-                    status_code=token_response.status_code,
-                    detail=token_response.text
-                )
 
-            await redis_client.add_key_value(
-                f'hubspot_credentials:{org_id}:{user_id}',
-                token_response.text,
-                expire=600
-            )
-            await redis_client.delete_key(f'hubspot_state:{org_id}:{user_id}')
+        token = token_response.json()
+        await credential_store.save('hubspot', org_id, user_id, token)
     except Exception as e:
-        print(f"Error during token exchange: {str(e)}")
+        logger.warning("HubSpot token exchange failed: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to exchange code for token: {str(e)}"
         )
     
-    return _get_close_window_response()
+    return _get_close_window_response(
+        loader.prefetch_task('hubspot', json.dumps(token), get_items_hubspot)
+    )
 
 
-async def get_hubspot_credentials(user_id, org_id):
-    """Retrieve HubSpot credentials from Redis."""
-    credentials = await redis_client.get_value(f'hubspot_credentials:{org_id}:{user_id}')
-    
-    if not credentials:
-        raise HTTPException(status_code=400, detail='No credentials found.')
-    
-    credentials = json.loads(credentials)
-    await redis_client.delete_key(f'hubspot_credentials:{org_id}:{user_id}')
+async def refresh_hubspot_token(refresh_token):
+    """Exchange a HubSpot refresh token for a new token response."""
+    response = await rate_limiter.request(
+        'hubspot',
+        'POST',
+        hubspot['token_url'],
+        data={
+            'grant_type': 'refresh_token',
+            'client_id': hubspot['client_id'],
+            'client_secret': hubspot['client_secret'],
+            'redirect_uri': hubspot['redirect_uri'],
+            'refresh_token': refresh_token
+        }
+    )
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=response.text)
+    return response.json()
+
 
-    return credentials
+async def get_hubspot_credentials(user_id, org_id):
+    """Return the connection status of stored HubSpot credentials, refreshing them if needed."""
+    return await credential_store.get_status('hubspot', org_id, user_id)
 
 
 def _get_item_name(response_json, item_type):
@@ -181,9 +216,13 @@ def _get_item_name(response_json, item_type):
 
 
 def _create_integration_item_metadata_object(response_json, item_type):
-    """Create IntegrationItem from HubSpot response."""
+    """Create IntegrationItem from HubSpot response.
+
+    Contact and company ids overlap, so ids are suffixed with the object
+    type like Airtable's, keeping them unique across a load.
+    """
     return IntegrationItem(
-        id=str(response_json.get('id')),
+        id=f"{response_json.get('id')}_{item_type}",
         type=item_type,
         name=_get_item_name(response_json, item_type),
         creation_time=response_json.get('createdAt'),
@@ -192,49 +231,162 @@ def _create_integration_item_metadata_object(response_json, item_type):
     )
 
 
-async def get_items_hubspot(credentials):
-    """Fetch contacts and companies from HubSpot."""
+async def _request_page(access_token, item_type, method, url, **kwargs):
+    """Stream a HubSpot list or search page into items, returning them and the next cursor."""
+    try:
+        async with rate_limiter.stream('hubspot', method, url, access_token, **kwargs) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise HTTPException(
+                    status_code=response.status_code,
+                    detail=response.text
+                )
+            items, fields = await json_stream.read_array(
+                'hubspot', response, 'results', ['paging.next.after'],
+                functools.partial(_create_integration_item_metadata_object, item_type=item_type)
+            )
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail='Request to HubSpot timed out')
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=500, detail=f'Failed to connect to HubSpot: {str(e)}')
+    return items, fields['paging.next.after']
+
+
+@metrics.counted_pages('hubspot')
+async def _fetch_objects(access_token, item_type):
+    """Yield pages of HubSpot CRM objects as items, following the paging cursor."""
+    headers = _get_headers(access_token)
+    url = f"{hubspot['api_base_url']}/crm/v3/objects/{_OBJECT_PATHS[item_type]}"
+    params = {
+        'limit': _PAGE_LIMIT,
+        'properties': ','.join(_OBJECT_PROPERTIES[item_type])
+    }
+
+    while True:
+        items, after = await _request_page(
+            access_token, item_type, 'GET', url, headers=headers, params=params
+        )
+        yield items
+
+        if not after:
+            break
+        params = {**params, 'after': after}
+
+
+def _search_body(item_type, operator, modified_after):
+    """Build a search body for objects modified after a time in epoch milliseconds."""
+    modified_property = _MODIFIED_PROPERTIES[item_type]
+    return {
+        'filterGroups': [{
+            'filters': [{
+                'propertyName': modified_property,
+                'operator': operator,
+                'value': str(modified_after)
+            }]
+        }],
+        'sorts': [{'propertyName': modified_property, 'direction': 'ASCENDING'}],
+        'properties': _OBJECT_PROPERTIES[item_type],
+        'limit': _PAGE_LIMIT
+    }
+
+
+def _modified_millis(item):
+    return int(loader.parse_timestamp(item.last_modified_time).timestamp() * 1000)
+
+
+@metrics.counted_pages('hubspot')
+async def _search_modified_objects(access_token, item_type, since):
+    """Yield pages of HubSpot CRM objects modified at or after ``since``, as items.
+
+    Search results stop at _SEARCH_RESULT_LIMIT per query, so once paging
+    nears it the query restarts from the last modified time seen.
+    """
+    headers = _get_headers(access_token)
+    url = f"{hubspot['api_base_url']}/crm/v3/objects/{_OBJECT_PATHS[item_type]}/search"
+    body = _search_body(item_type, 'GTE', int(since.timestamp() * 1000))
+    fetched = 0
+    first_modified = None
+
+    while True:
+        items, after = await _request_page(
+            access_token, item_type, 'POST', url, headers=headers, json=body
+        )
+        yield items
+        if items and first_modified is None:
+            first_modified = _modified_millis(items[0])
+        fetched += len(items)
+
+        if not after:
+            break
+        if fetched + _PAGE_LIMIT <= _SEARCH_RESULT_LIMIT:
+            body = {**body, 'after': after}
+            continue
+
+        last_modified = _modified_millis(items[-1])
+        if last_modified > first_modified:
+            # Objects modified at the new anchor itself are fetched again and merged
+            body = _search_body(item_type, 'GTE', last_modified)
+        else:
+            logger.warning(
+                'More than %s HubSpot %s objects share one modified time; '
+                'the rest are picked up by the next full sync',
+                _SEARCH_RESULT_LIMIT, item_type
+            )
+            body = _search_body(item_type, 'GT', last_modified)
+        fetched = 0
+        first_modified = None
+
+
+async def _collect_items(pages):
+    """Collect every page of HubSpot items."""
+    return [item async for items in pages for item in items]
+
+
+def _get_access_token(credentials):
+    """Extract the access token from a HubSpot credentials payload."""
     credentials = json.loads(credentials)
     access_token = credentials.get('access_token')
 
     if not access_token:
         raise HTTPException(status_code=400, detail='Invalid credentials')
 
-    headers = {
+    return access_token
+
+
+def _get_headers(access_token):
+    """Build HubSpot API headers for an access token."""
+    return {
         'Authorization': f'Bearer {access_token}',
         'Content-Type': 'application/json'
     }
 
-    async with httpx.AsyncClient() as client:
-        # Fetch contacts and companies concurrently
-        contacts_task = client.get(
-            f"{hubspot['api_base_url']}/crm/v3/objects/contacts",
-            headers=headers
-        )
-        companies_task = client.get(
-            f"{hubspot['api_base_url']}/crm/v3/objects/companies",
-            headers=headers
-        )
-        # Wait for both requests to complete
-        contacts_response, companies_response = await asyncio.gather(contacts_task, companies_task)
 
-    if contacts_response.status_code != 200:
-        raise HTTPException(
-            status_code=contacts_response.status_code,
-            detail=contacts_response.text
-        )
+async def iter_items_hubspot(credentials):
+    """Yield pages of contacts and companies as either stream delivers them."""
+    access_token = _get_access_token(credentials)
+    async for items in streaming.merge(
+        _fetch_objects(access_token, 'contact'),
+        _fetch_objects(access_token, 'company')
+    ):
+        yield items
 
-    if companies_response.status_code != 200:
-        raise HTTPException(
-            status_code=companies_response.status_code,
-            detail=companies_response.text
-        )
 
-    items = []
-    # Process contacts
-    for contact in contacts_response.json().get('results', []):
-        items.append(_create_integration_item_metadata_object(contact, 'contact'))
-    # Process companies
-    for company in companies_response.json().get('results', []):
-        items.append(_create_integration_item_metadata_object(company, 'company'))
-    return items
\ No newline at end of file
+async def get_items_hubspot(credentials):
+    """Fetch contacts and companies from HubSpot."""
+    access_token = _get_access_token(credentials)
+    # Page through contacts and companies concurrently
+    contacts, companies = await asyncio.gather(
+        _collect_items(_fetch_objects(access_token, 'contact')),
+        _collect_items(_fetch_objects(access_token, 'company'))
+    )
+    return contacts + companies
+
+
+async def get_changed_items_hubspot(credentials, since):
+    """Fetch contacts and companies modified since the given datetime."""
+    access_token = _get_access_token(credentials)
+    contacts, companies = await asyncio.gather(
+        _collect_items(_search_modified_objects(access_token, 'contact', since)),
+        _collect_items(_search_modified_objects(access_token, 'company', since))
+    )
+    return contacts + companies
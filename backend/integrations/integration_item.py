@@ -1,35 +1,38 @@
+from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional, List
 
+import orjson
+
+
+@dataclass(slots=True)
 class IntegrationItem:
-    def __init__(
-        self,
-        id: Optional[str] = None,
-        type: Optional[str] = None,
-        directory: bool = False,
-        parent_path_or_name: Optional[str] = None,
-        parent_id: Optional[str] = None,
-        name: Optional[str] = None,
-        creation_time: Optional[datetime] = None,
-        last_modified_time: Optional[datetime] = None,
-        url: Optional[str] = None,
-        children: Optional[List[str]] = None,
-        mime_type: Optional[str] = None,
-        delta: Optional[str] = None,
-        drive_id: Optional[str] = None,
-        visibility: Optional[bool] = True,
-    ):
-        self.id = id
-        self.type = type
-        self.directory = directory
-        self.parent_path_or_name = parent_path_or_name
-        self.parent_id = parent_id
-        self.name = name
-        self.creation_time = creation_time
-        self.last_modified_time = last_modified_time
-        self.url = url
-        self.children = children
-        self.mime_type = mime_type
-        self.delta = delta
-        self.drive_id = drive_id
-        self.visibility = visibility
+    id: Optional[str] = None
+    type: Optional[str] = None
+    directory: bool = False
+    parent_path_or_name: Optional[str] = None
+    parent_id: Optional[str] = None
+    name: Optional[str] = None
+    creation_time: Optional[datetime] = None
+    last_modified_time: Optional[datetime] = None
+    url: Optional[str] = None
+    children: Optional[List[str]] = None
+    mime_type: Optional[str] = None
+    delta: Optional[str] = None
+    drive_id: Optional[str] = None
+    visibility: Optional[bool] = True
+
+
+def serialize_items(items: List[IntegrationItem]) -> bytes:
+    """Serialize IntegrationItems to JSON bytes."""
+    return orjson.dumps(items)
+
+
+def serialize_item_lines(items: List[IntegrationItem]) -> bytes:
+    """Serialize IntegrationItems as newline-delimited JSON."""
+    return b''.join(orjson.dumps(item) + b'\n' for item in items)
+
+
+def deserialize_items(data: bytes) -> List[IntegrationItem]:
+    """Rebuild IntegrationItems from serialize_items output."""
+    return [IntegrationItem(**fields) for fields in orjson.loads(data)]
@@ -1,15 +1,24 @@
 import json
+import logging
+from datetime import datetime
 import secrets
 from fastapi import Request, HTTPException
 from fastapi.responses import HTMLResponse
 import httpx
-import asyncio
 import base64
-import requests
 
 from integrations.integration_item import IntegrationItem
+import credential_store
+import json_stream
+import loader
+import rate_limiter
 import redis_client
 from config import notion
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_PAGE_SIZE = 100
 
 
 def _get_encoded_client_credentials():
@@ -57,11 +66,11 @@ async def authorize_notion(user_id, org_id):
 
     # Build auth URL
     auth_url = _get_auth_url(encoded_state)
-    print("Authorization URL:", auth_url)
+    logger.debug("Starting Notion authorization for org %s user %s", org_id, user_id)
     return auth_url
 
 
-def _get_close_window_response():
+def _get_close_window_response(background=None):
     """Return HTML response to close the OAuth window."""
     return HTMLResponse(content="""
         <html>
@@ -69,7 +78,7 @@ def _get_close_window_response():
                 window.close();
             </script>
         </html>
-    """)
+    """, background=background)
 
 
 async def oauth2callback_notion(request: Request):
@@ -90,78 +99,64 @@ async def oauth2callback_notion(request: Request):
     org_id = state_data.get('org_id')
     original_state = state_data.get('state')
 
-    saved_state = await redis_client.get_value(f'notion_state:{org_id}:{user_id}')
+    saved_state = await redis_client.get_and_delete_value(f'notion_state:{org_id}:{user_id}')
 
     if not saved_state or original_state != json.loads(saved_state).get('state'):
         raise HTTPException(status_code=400, detail='State does not match.')
 
     encoded_credentials = _get_encoded_client_credentials()
     
-    async with httpx.AsyncClient() as client:
-        response, _ = await asyncio.gather(
-            client.post(
-                notion['token_url'],
-                json={
-                    'grant_type': 'authorization_code',
-                    'code': code,
-                    'redirect_uri': notion['redirect_uri']
-                },
-                headers={
-                    'Authorization': f'Basic {encoded_credentials}',
-                    'Content-Type': 'application/json',
-                }
-            ),
-            redis_client.delete_key(f'notion_state:{org_id}:{user_id}')
-        )
-
-    await redis_client.add_key_value(
-        f'notion_credentials:{org_id}:{user_id}',
-        json.dumps(response.json()),
-        expire=600
+    response = await rate_limiter.request(
+        'notion',
+        'POST',
+        notion['token_url'],
+        json={
+            'grant_type': 'authorization_code',
+            'code': code,
+            'redirect_uri': notion['redirect_uri']
+        },
+        headers={
+            'Authorization': f'Basic {encoded_credentials}',
+            'Content-Type': 'application/json',
+        }
     )
-    
-    return _get_close_window_response()
 
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=response.text)
 
-async def get_notion_credentials(user_id, org_id):
-    """Retrieve Notion credentials from Redis."""
-    credentials = await redis_client.get_value(f'notion_credentials:{org_id}:{user_id}')
-    
-    if not credentials:
-        raise HTTPException(status_code=400, detail='No credentials found.')
+    # Notion access tokens do not expire, so there is nothing to refresh
+    token = response.json()
+    await credential_store.save('notion', org_id, user_id, token)
     
-    credentials = json.loads(credentials)
-    await redis_client.delete_key(f'notion_credentials:{org_id}:{user_id}')
-
-    return credentials
-
+    return _get_close_window_response(
+        loader.prefetch_task('notion', json.dumps(token), get_items_notion)
+    )
 
-def _recursive_dict_search(data, target_key):
-    """Recursively search for a key in a dictionary of dictionaries."""
-    if target_key in data:
-        return data[target_key]
 
-    for value in data.values():
-        if isinstance(value, dict):
-            result = _recursive_dict_search(value, target_key)
-            if result is not None:
-                return result
-        elif isinstance(value, list):
-            for item in value:
-                if isinstance(item, dict):
-                    result = _recursive_dict_search(item, target_key)
-                    if result is not None:
-                        return result
-    return None
+async def get_notion_credentials(user_id, org_id):
+    """Return the connection status of stored Notion credentials, refreshing them if needed."""
+    return await credential_store.get_status('notion', org_id, user_id)
+
+
+def _get_title(response_json):
+    """Return the plain text title of a Notion page or database."""
+    if response_json['object'] == 'database':
+        rich_text = response_json.get('title') or []
+    else:
+        rich_text = next(
+            (
+                prop.get('title') or []
+                for prop in response_json.get('properties', {}).values()
+                if prop.get('type') == 'title'
+            ),
+            []
+        )
+    return ''.join(run.get('plain_text', '') for run in rich_text)
 
 
 def _get_item_name(response_json):
     """Extract name from Notion response."""
-    name = _recursive_dict_search(response_json['properties'], 'content')
-    if name is None:
-        name = _recursive_dict_search(response_json, 'content')
-    if name is None:
-        name = 'multi_select'
+    name = _get_title(response_json) or 'multi_select'
     return f"{response_json['object']} {name}"
 
 
@@ -185,41 +180,94 @@ def _create_integration_item_metadata_object(response_json: str) -> IntegrationI
     )
 
 
-async def get_items_notion(credentials) -> list[IntegrationItem]:
-    """Fetch and process items from Notion."""
-    credentials = json.loads(credentials)
-    access_token = credentials.get('access_token')
+def _convert_result(result):
+    """Create an item from a search result, skipping results without an id."""
+    return _create_integration_item_metadata_object(result) if result.get('id') else None
+
 
-    async with httpx.AsyncClient(timeout=30.0) as client:
+@metrics.counted_pages('notion')
+async def _search(access_token, sort=None):
+    """Yield pages of Notion /search results as items, following the start cursor."""
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+        'Notion-Version': notion['api_version'],
+    }
+    body = {'page_size': _PAGE_SIZE}
+    if sort is not None:
+        body['sort'] = sort
+
+    while True:
         try:
-            response = await client.post(
+            async with rate_limiter.stream(
+                'notion',
+                'POST',
                 f"{notion['api_base_url']}/search",
-                headers={
-                    'Authorization': f'Bearer {access_token}',
-                    'Notion-Version': notion['api_version'],
-                }
-            )
+                access_token,
+                headers=headers,
+                json=body
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise HTTPException(
+                        status_code=response.status_code,
+                        detail=response.text
+                    )
+                items, fields = await json_stream.read_array(
+                    'notion', response, 'results', ['next_cursor'], _convert_result
+                )
         except httpx.TimeoutException:
             raise HTTPException(status_code=504, detail='Request to Notion timed out')
         except httpx.RequestError as e:
             raise HTTPException(status_code=500, detail=f'Failed to connect to Notion: {str(e)}')
 
-    if response.status_code != 200:
-        raise HTTPException(
-            status_code=response.status_code,
-            detail=response.text
-        )
+        yield items
+
+        # Notion sends a null next_cursor on the last page
+        next_cursor = fields['next_cursor']
+        if not next_cursor:
+            break
+        body = {**body, 'start_cursor': next_cursor}
+
+
+def _create_unique_items(items, seen_ids):
+    """Return the items whose ids were not seen on earlier pages."""
+    unique = []
+    for item in items:
+        if item.id not in seen_ids:
+            seen_ids.add(item.id)
+            unique.append(item)
+    return unique
+
+
+async def iter_items_notion(credentials):
+    """Yield pages of deduplicated Notion items as search results arrive."""
+    credentials = json.loads(credentials)
+    access_token = credentials.get('access_token')
+
+    seen_ids = set()
+    async for items in _search(access_token):
+        yield _create_unique_items(items, seen_ids)
+
+
+async def get_items_notion(credentials) -> list[IntegrationItem]:
+    """Fetch and process items from Notion."""
+    return [item async for items in iter_items_notion(credentials) for item in items]
+
+
+async def get_changed_items_notion(credentials, since) -> list[IntegrationItem]:
+    """Fetch Notion items edited at or after the given datetime."""
+    credentials = json.loads(credentials)
+    access_token = credentials.get('access_token')
 
-    results = response.json()['results']
+    sort = {'direction': 'descending', 'timestamp': 'last_edited_time'}
     seen_ids = set()
-    unique_results = []
-    for result in results:
-        rid = result.get('id')
-        if rid and rid not in seen_ids:
-            seen_ids.add(rid)
-            unique_results.append(result)
-
-    return [
-        _create_integration_item_metadata_object(result)
-        for result in unique_results
-    ]
+    items = []
+    async for page in _search(access_token, sort=sort):
+        for index, item in enumerate(page):
+            edited = datetime.fromisoformat(item.last_modified_time.replace('Z', '+00:00'))
+            if edited < since:
+                items.extend(_create_unique_items(page[:index], seen_ids))
+                return items
+        items.extend(_create_unique_items(page, seen_ids))
+
+    return items
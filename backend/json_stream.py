@@ -0,0 +1,126 @@
+import asyncio
+
+import ijson
+import orjson
+
+import metrics
+import offload
+from config import offload as offload_config
+
+# Bytes parsed between yields to the event loop
+_CHUNK_SIZE = 16 * 1024
+
+_backend = ijson.get_backend(ijson.backend_name)
+
+
+def _lookup(document, path):
+    for key in path.split('.'):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(key)
+    return document
+
+
+def _convert_all(elements, convert):
+    if convert is None:
+        return list(elements)
+    return [value for value in map(convert, elements) if value is not None]
+
+
+def parse_array(body, path, fields=(), convert=None):
+    """Decode a whole JSON body, returning the array at ``path`` and the ``fields``.
+
+    The buffered counterpart of ArrayParser, with the same arguments and
+    results: converted elements and a dict of field values. Module-level so
+    it can run in a process pool.
+    """
+    document = orjson.loads(body)
+    elements = _lookup(document, path)
+    if not isinstance(elements, list):
+        elements = []
+    return _convert_all(elements, convert), {field: _lookup(document, field) for field in fields}
+
+
+class ArrayParser:
+    """Incremental parser for the elements of one array in a JSON document.
+
+    Elements are returned as soon as they are complete, so only the element
+    being parsed and the current chunk are held, however large the body is.
+    Scalars at ``fields`` paths (such as paging cursors, which often follow
+    the array) are collected into ``fields``. Paths use ijson's dotted form,
+    e.g. ``paging.next.after``. ``convert``, if given, is applied to each
+    element where it is parsed, and elements it returns None for are dropped.
+    """
+
+    def __init__(self, path, fields=(), convert=None):
+        self.fields = dict.fromkeys(fields)
+        self._path = path
+        self._convert = convert
+        self._elements = ijson.sendable_list()
+        # The body is tokenized once; the array's events go on to a C builder
+        self._items = _backend.items_basecoro(self._elements, f'{path}.item', None)
+        self._pipeline = ijson.parse_coro(self, use_float=True)
+
+    def send(self, event):
+        prefix = event[0]
+        if prefix in self.fields:
+            self.fields[prefix] = event[2]
+        elif prefix.startswith(self._path):
+            self._items.send(event)
+
+    def _take(self):
+        elements = _convert_all(self._elements, self._convert)
+        del self._elements[:]
+        return elements
+
+    def feed(self, chunk):
+        """Parse the next chunk of the body and return the elements it completed."""
+        # ijson takes an empty chunk as the end of the body
+        if chunk:
+            self._pipeline.send(chunk)
+        return self._take()
+
+    def close(self):
+        """Finish the document and return any last elements.
+
+        Raises ijson.IncompleteJSONError if the body was cut short.
+        """
+        self._pipeline.close()
+        return self._take()
+
+
+async def read_array(provider, response, path, fields=(), convert=None):
+    """Return the converted elements of the array at ``path`` of a streamed response, and the ``fields``.
+
+    Bodies under OFFLOAD_THRESHOLD_BYTES are read whole and decoded inline,
+    which is cheapest. Larger ones are parsed with an ArrayParser chunk by
+    chunk as they arrive, on an offload thread (inline with ``none``), so
+    neither the body nor its parse tree is held whole. A process pool cannot
+    keep a parser between chunks, so there large bodies are read whole and
+    decoded in it; ``convert`` must then be a module-level function.
+    """
+    threshold = offload_config['threshold_bytes']
+    executor = offload_config['executor']
+    chunks = []
+    size = 0
+    parser = None
+    elements = []
+    async for chunk in response.aiter_bytes(_CHUNK_SIZE):
+        if parser is None:
+            chunks.append(chunk)
+            size += len(chunk)
+            if size < threshold or executor == 'process':
+                continue
+            if executor != 'none':
+                metrics.OFFLOADED_PAGES.labels(provider).inc()
+            parser = ArrayParser(path, fields, convert)
+            chunk = b''.join(chunks)
+            chunks = None
+        elements += await offload.compute(parser.feed, chunk)
+        # Chunks already buffered by httpx arrive without suspending
+        await asyncio.sleep(0)
+
+    if parser is not None:
+        elements += parser.close()
+        return elements, parser.fields
+    return await offload.decode(provider, parse_array, b''.join(chunks), path, fields, convert)
@@ -0,0 +1,329 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import replace
+from datetime import datetime
+
+from starlette.background import BackgroundTask
+
+import hierarchy
+import metrics
+import offload
+import redis_client
+import search_index
+import singleflight
+from config import cache as cache_config
+from integrations.integration_item import serialize_items
+
+logger = logging.getLogger(__name__)
+
+# In-process hierarchy indexes: cache key -> (expires_at, HierarchyIndex)
+_indexes = OrderedDict()
+# In-process query results: (cache key, query key) -> (expires_at, result)
+_results = OrderedDict()
+_result_items = 0
+
+
+def _get_access_token(credentials):
+    return json.loads(credentials).get('access_token')
+
+
+async def load_items(provider, credentials, get_items, refresh=False):
+    """Load a provider's items, serving repeat loads from the Redis cache.
+
+    ``refresh`` bypasses the cached result and replaces it with a fresh fetch.
+    Concurrent loads for the same provider token are coalesced into one fetch.
+    """
+    with metrics.track_load(provider, 'full') as load:
+        items = await _load_items(provider, credentials, get_items, refresh, load)
+        load.items = len(items)
+        return items
+
+
+async def load_payload(provider, credentials, get_items, refresh=False):
+    """Load a provider's items like ``load_items``, as serialized JSON.
+
+    Cache hits are decompressed off the event loop and returned as stored,
+    rather than rebuilt into items only to be serialized again.
+    """
+    with metrics.track_load(provider, 'full') as load:
+        access_token = _get_access_token(credentials)
+        if access_token and not refresh:
+            payload = await redis_client.get_cached_payload(provider, access_token)
+            if payload is not None:
+                load.mode = 'cache'
+                data, load.items = await offload.compute(redis_client.decompress_items, payload)
+                return data
+        # The cache was checked above
+        items = await _load_items(provider, credentials, get_items, True, load)
+        load.items = len(items)
+        return serialize_items(items)
+
+
+async def _get_cached_items(provider, access_token):
+    payload = await redis_client.get_cached_payload(provider, access_token)
+    if payload is None:
+        return None
+    return await offload.compute(redis_client.decode_items, payload)
+
+
+async def _load_items(provider, credentials, get_items, refresh, load):
+    access_token = _get_access_token(credentials)
+    if access_token and not refresh:
+        cached = await _get_cached_items(provider, access_token)
+        if cached is not None:
+            load.mode = 'cache'
+            return cached
+
+    if not access_token:
+        return await get_items(credentials)
+
+    async def _fetch():
+        items = await get_items(credentials)
+        hierarchy.build_index(items)
+        await redis_client.set_cached_items(provider, access_token, items)
+        return items
+
+    # Concurrent identical loads share one upstream fetch
+    key = f'{provider}:{redis_client.token_fingerprint(access_token)}'
+    if cache_config['ttl'].get(provider):
+        # Other workers read the result from the item cache _fetch fills
+        items = await singleflight.run(
+            key, _fetch, read=lambda: _get_cached_items(provider, access_token)
+        )
+    else:
+        items = await singleflight.run(key, _fetch, redis_client.encode_items, redis_client.decode_items)
+    _drop_results(key)
+    return items
+
+
+def _drop_results(key):
+    """Forget this worker's query results over a load that has been replaced."""
+    global _result_items
+    for result_key in [result_key for result_key in _results if result_key[0] == key]:
+        _result_items -= len(_results.pop(result_key)[1].items)
+
+
+async def get_hierarchy(provider, credentials, get_items, refresh=False):
+    """Return the hierarchy index of a provider's items, built from the cached load.
+
+    Indexes are kept in this worker for the provider's cache TTL, so repeat
+    subtree lookups skip both Redis and the rebuild.
+    """
+    access_token = _get_access_token(credentials)
+    key = f'{provider}:{redis_client.token_fingerprint(access_token)}' if access_token else None
+    entry = _indexes.get(key) if key else None
+    if entry is not None and not refresh and entry[0] > time.monotonic():
+        _indexes.move_to_end(key)
+        return entry[1]
+
+    index = hierarchy.build_index(await load_items(provider, credentials, get_items, refresh))
+    ttl = cache_config['ttl'].get(provider)
+    if key and ttl:
+        _indexes[key] = (time.monotonic() + ttl, index)
+        _indexes.move_to_end(key)
+        while len(_indexes) > cache_config['index_size']:
+            _indexes.popitem(last=False)
+    return index
+
+
+async def get_query_result(provider, credentials, get_items, query_key, run_query, refresh=False):
+    """Return ``run_query(items)`` over a provider's cached load.
+
+    Results are kept in this worker per token and ``query_key`` for the
+    provider's cache TTL, like hierarchy indexes, so paging through a
+    filtered or sorted load does not decode, filter and sort it all again.
+    The query runs on an offload thread. Results (which must have ``items``)
+    are kept up to QUERY_CACHE_ITEMS items in all, and dropped when this
+    worker fetches the load again.
+    """
+    global _result_items
+    access_token = _get_access_token(credentials)
+    key = (f'{provider}:{redis_client.token_fingerprint(access_token)}', query_key) if access_token else None
+    entry = _results.get(key) if key else None
+    if entry is not None and not refresh and entry[0] > time.monotonic():
+        _results.move_to_end(key)
+        return entry[1]
+
+    result = await offload.compute(run_query, await load_items(provider, credentials, get_items, refresh))
+    ttl = cache_config['ttl'].get(provider)
+    capacity = cache_config['query_items']
+    if key and ttl and len(result.items) <= capacity:
+        previous = _results.pop(key, None)
+        if previous is not None:
+            _result_items -= len(previous[1].items)
+        _results[key] = (time.monotonic() + ttl, result)
+        _result_items += len(result.items)
+        while _result_items > capacity:
+            _, (_, evicted) = _results.popitem(last=False)
+            _result_items -= len(evicted.items)
+    return result
+
+
+async def prefetch_items(provider, credentials, get_items):
+    """Warm the item cache for freshly issued credentials, logging any failure."""
+    if not _get_access_token(credentials):
+        return
+    try:
+        await load_items(provider, credentials, get_items)
+    except Exception as e:
+        logger.warning('Prefetch of %s items failed: %s', provider, e)
+
+
+def prefetch_task(provider, credentials, get_items):
+    """Return a BackgroundTask that prefetches items, or None if prefetch is off.
+
+    The task runs once the OAuth callback response has been sent, so the
+    user's first /load is served from the cache, or joins the in-flight
+    fetch through the single-flight key.
+    """
+    if not cache_config['prefetch']:
+        return None
+    return BackgroundTask(prefetch_items, provider, credentials, get_items)
+
+
+async def iter_items(provider, credentials, iter_provider_items, refresh=False):
+    """Yield pages of a provider's items, using a cached result when present.
+
+    Streamed loads do not populate the cache, since that would mean holding
+    the whole result in memory.
+    """
+    with metrics.track_load(provider, 'stream') as load:
+        access_token = _get_access_token(credentials)
+        if access_token and not refresh:
+            cached = await _get_cached_items(provider, access_token)
+            if cached is not None:
+                load.mode = 'cache'
+                load.items = len(cached)
+                yield cached
+                return
+
+        async for items in iter_provider_items(credentials):
+            load.items += len(items)
+            yield items
+
+
+async def iter_records(provider, credentials, iter_provider_records):
+    """Yield pages of a provider's records.
+
+    Record loads can be arbitrarily large, so they are never cached.
+    """
+    with metrics.track_load(provider, 'records') as load:
+        async for items in iter_provider_records(credentials):
+            load.items += len(items)
+            yield items
+
+
+def parse_timestamp(value):
+    """Parse an ISO 8601 provider timestamp, returning None if it is missing."""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _get_watermark(items, previous=None):
+    """Return the latest last_modified_time among items as an ISO string."""
+    latest = parse_timestamp(previous)
+    for item in items:
+        modified = parse_timestamp(item.last_modified_time)
+        if modified is not None and (latest is None or modified > latest):
+            latest = modified
+    return latest.isoformat() if latest is not None else None
+
+
+def _merge_changes(snapshot, changed):
+    """Apply changed items on top of a snapshot, marking each change's delta.
+
+    Items are matched on (type, id), so ids only need to be unique per type.
+    """
+    merged = {}
+    for item in snapshot:
+        item.delta = None
+        item.children = None
+        merged[(item.type, item.id)] = item
+    for item in changed:
+        old = merged.get((item.type, item.id))
+        if old is None:
+            item.delta = 'added'
+        elif old != item:
+            item.delta = 'modified'
+        merged[(item.type, item.id)] = item
+    return list(merged.values())
+
+
+def _diff_items(snapshot, current):
+    """Mark current items against a snapshot and return them plus removed items."""
+    previous = {(item.type, item.id): item for item in snapshot}
+    for item in current:
+        old = previous.pop((item.type, item.id), None)
+        if old is None:
+            item.delta = 'added'
+        else:
+            old.delta = None
+            old.children = None
+            item.delta = None if old == item else 'modified'
+    removed = list(previous.values())
+    for item in removed:
+        item.delta = 'removed'
+    return current, removed
+
+
+async def sync_items(provider, credentials, org_id, user_id, get_items, get_changed_items=None):
+    """Incrementally sync a user's provider items against their stored snapshot.
+
+    Providers with a ``get_changed_items(credentials, since)`` fetcher only
+    pull objects modified since the stored watermark; others are fetched in
+    full and diffed. Changed items carry ``delta`` set to ``added``,
+    ``modified`` or ``removed``.
+    """
+    with metrics.track_load(provider, 'incremental') as load:
+        items = await _sync_items(provider, credentials, org_id, user_id, get_items, get_changed_items)
+        load.items = len(items)
+        return items
+
+
+def _full_sync_due(full_synced_at):
+    interval = cache_config['full_sync_interval']
+    return bool(interval) and (full_synced_at is None or time.time() - full_synced_at >= interval)
+
+
+def _without_delta(items):
+    """Return items with ``delta`` cleared, copying only the marked ones."""
+    return [replace(item, delta=None) if item.delta else item for item in items]
+
+
+async def _sync_items(provider, credentials, org_id, user_id, get_items, get_changed_items):
+    snapshot, watermark, version, full_synced_at = await redis_client.get_snapshot(
+        provider, org_id, user_id
+    )
+
+    removed = []
+    if snapshot is None:
+        items = await get_items(credentials)
+        full_synced_at = time.time()
+    elif get_changed_items is not None and watermark is not None and not _full_sync_due(full_synced_at):
+        changed = await get_changed_items(credentials, parse_timestamp(watermark))
+        items = _merge_changes(snapshot, changed)
+    else:
+        # Watermark syncs never see deletions, so they are diffed in full now and then
+        items, removed = _diff_items(snapshot, await get_items(credentials))
+        full_synced_at = time.time()
+    # Children are derived, so they are rebuilt after the comparison above
+    hierarchy.build_index(items)
+
+    # Deltas describe this sync only, so stored copies carry none
+    stored = _without_delta(items)
+    new_version = await redis_client.set_snapshot(
+        provider, org_id, user_id, stored, _get_watermark(items, watermark), full_synced_at
+    )
+    search_index.update(
+        provider, org_id, user_id, version, new_version,
+        [current for current, item in zip(stored, items) if item.delta], removed
+    )
+    access_token = _get_access_token(credentials)
+    if access_token:
+        await redis_client.set_cached_items(provider, access_token, stored)
+    return items + removed
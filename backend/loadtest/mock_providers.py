@@ -0,0 +1,193 @@
+"""Local stand-ins for the Airtable, Notion and HubSpot endpoints used by the API.
+
+Serves every provider from one app under /airtable, /notion and /hubspot with
+configurable latency, page counts and injected 429 responses:
+
+    python -m loadtest.mock_providers --port 8100 --latency-ms 50 --pages 3
+"""
+import argparse
+import asyncio
+import random
+import secrets
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+_PAGE_SIZE = 100
+
+
+def create_app(latency_ms=0.0, pages=1, tables_per_base=3, throttle_rate=0.0, retry_after=1):
+    """Create the mock provider app.
+
+    Each listing returns ``pages`` full pages of ``_PAGE_SIZE`` objects. A
+    ``throttle_rate`` fraction of data requests is answered with 429 and a
+    ``Retry-After`` of ``retry_after`` seconds.
+    """
+    app = FastAPI(title='Mock Providers')
+    total = pages * _PAGE_SIZE
+
+    async def _respond(body):
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        if throttle_rate and random.random() < throttle_rate:
+            return JSONResponse({'error': 'rate_limited'}, status_code=429,
+                                headers={'Retry-After': str(retry_after)})
+        return JSONResponse(body)
+
+    def _token():
+        return {
+            'access_token': secrets.token_urlsafe(24),
+            'refresh_token': secrets.token_urlsafe(24),
+            'token_type': 'bearer',
+            'expires_in': 3600
+        }
+
+    @app.get('/health')
+    def health():
+        return {'status': 'ok'}
+
+    # Airtable
+    @app.post('/airtable/oauth2/v1/token')
+    async def airtable_token():
+        return await _respond(_token())
+
+    @app.get('/airtable/v0/meta/bases')
+    async def airtable_bases(offset: int = 0):
+        bases = [
+            {'id': f'app{i:014d}', 'name': f'Base {i}', 'permissionLevel': 'create'}
+            for i in range(offset, min(offset + _PAGE_SIZE, total))
+        ]
+        body = {'bases': bases}
+        if offset + _PAGE_SIZE < total:
+            body['offset'] = str(offset + _PAGE_SIZE)
+        return await _respond(body)
+
+    @app.get('/airtable/v0/meta/bases/{base_id}/tables')
+    async def airtable_tables(base_id: str):
+        return await _respond({'tables': [
+            {
+                'id': f'tbl{base_id[3:]}{j}',
+                'name': f'Table {j}',
+                'primaryFieldId': f'fld{j:014d}',
+                'fields': [{'id': f'fld{j:014d}', 'name': 'Name', 'type': 'singleLineText'}]
+            }
+            for j in range(tables_per_base)
+        ]})
+
+    # Declared after the meta routes, which would otherwise match as a base and table id
+    @app.get('/airtable/v0/{base_id}/{table_id}')
+    async def airtable_records(base_id: str, table_id: str, offset: int = 0):
+        records = [
+            {
+                'id': f'rec{table_id[3:]}{i:06d}',
+                'createdTime': '2024-01-01T00:00:00.000Z',
+                'fields': {f'fld{int(table_id[-1]):014d}': f'Row {i}'}
+            }
+            for i in range(offset, min(offset + _PAGE_SIZE, total))
+        ]
+        body = {'records': records}
+        if offset + _PAGE_SIZE < total:
+            body['offset'] = str(offset + _PAGE_SIZE)
+        return await _respond(body)
+
+    # Notion
+    @app.post('/notion/v1/oauth/token')
+    async def notion_token():
+        return await _respond(_token())
+
+    @app.post('/notion/v1/search')
+    async def notion_search(request: Request):
+        body = await request.json() if await request.body() else {}
+        start = int(body.get('start_cursor') or 0)
+        page_size = min(int(body.get('page_size', _PAGE_SIZE)), _PAGE_SIZE)
+        results = [
+            {
+                'object': 'page',
+                'id': f'{i:08x}-0000-4000-8000-000000000000',
+                'created_time': '2024-01-01T00:00:00.000Z',
+                'last_edited_time': '2024-02-01T00:00:00.000Z',
+                'parent': {'type': 'workspace', 'workspace': True},
+                'properties': {
+                    'title': {
+                        'id': 'title',
+                        'type': 'title',
+                        'title': [{'type': 'text', 'plain_text': f'Page {i}', 'text': {'content': f'Page {i}'}}]
+                    }
+                }
+            }
+            for i in range(start, min(start + page_size, total))
+        ]
+        has_more = start + page_size < total
+        return await _respond({
+            'object': 'list',
+            'results': results,
+            'has_more': has_more,
+            'next_cursor': str(start + page_size) if has_more else None
+        })
+
+    # HubSpot
+    @app.post('/hubspot/oauth/v1/token')
+    async def hubspot_token():
+        return await _respond(_token())
+
+    def _hubspot_page(object_type, after, limit):
+        results = [
+            {
+                'id': str(i),
+                'properties': {'firstname': 'Test', 'lastname': f'Contact {i}', 'name': f'Company {i}'},
+                'createdAt': '2024-01-01T00:00:00.000Z',
+                'updatedAt': '2024-02-01T00:00:00.000Z',
+                'archived': False
+            }
+            for i in range(after, min(after + limit, total))
+        ]
+        body = {'results': results}
+        if after + limit < total:
+            body['paging'] = {'next': {'after': str(after + limit)}}
+        return body
+
+    @app.get('/hubspot/crm/v3/objects/{object_type}')
+    async def hubspot_objects(object_type: str, after: int = 0, limit: int = 10):
+        return await _respond(_hubspot_page(object_type, after, min(limit, _PAGE_SIZE)))
+
+    @app.post('/hubspot/crm/v3/objects/{object_type}/search')
+    async def hubspot_search(object_type: str, request: Request):
+        body = await request.json()
+        after = int(body.get('after') or 0)
+        return await _respond(_hubspot_page(object_type, after, min(int(body.get('limit', 10)), _PAGE_SIZE)))
+
+    return app
+
+
+def provider_env(base_url):
+    """Return the config environment variables that point the API at this server."""
+    return {
+        'AIRTABLE_TOKEN_URL': f'{base_url}/airtable/oauth2/v1/token',
+        'AIRTABLE_API_BASE_URL': f'{base_url}/airtable/v0',
+        'NOTION_TOKEN_URL': f'{base_url}/notion/v1/oauth/token',
+        'NOTION_API_BASE_URL': f'{base_url}/notion/v1',
+        'HUBSPOT_TOKEN_URL': f'{base_url}/hubspot/oauth/v1/token',
+        'HUBSPOT_API_BASE_URL': f'{base_url}/hubspot'
+    }
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--pages', type=int, default=1)
+    parser.add_argument('--tables-per-base', type=int, default=3)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+
+    app = create_app(args.latency_ms, args.pages, args.tables_per_base,
+                     args.throttle_rate, args.retry_after)
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""End-to-end load test of api.app against local mock providers.
+
+Starts loadtest.mock_providers in a subprocess, points the provider URLs in
+config.py at it, serves api.app with uvicorn, and drives concurrent OAuth
+callback and /load traffic, then reports throughput and latency per route:
+
+    python -m loadtest.run --users 20 --loads 5 --latency-ms 50 --pages 3 --fake-redis
+
+--fake-redis needs ``pip install fakeredis[lua]``; without it the API uses the
+Redis configured by REDIS_HOST/REDIS_PORT. Provider rate limits are lifted
+unless --respect-rate-limits is given, so the API rather than the token
+buckets is what gets measured.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs, urlparse
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _BACKEND_DIR)
+
+from loadtest.mock_providers import provider_env  # noqa: E402
+
+_PROVIDERS = ('airtable', 'notion', 'hubspot')
+
+
+class Recorder:
+    """Collect latencies and failures per route."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.successes = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    async def call(self, route, request):
+        start = time.perf_counter()
+        try:
+            response = await request
+        except Exception:
+            self.errors[route] += 1
+            return None
+        self.latencies[route].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[route] += 1
+            return None
+        self.successes[route] += 1
+        return response
+
+    def report(self, elapsed):
+        print(f"\n{'route':<36}{'ok':>7}{'err':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for route in sorted(set(self.latencies) | set(self.errors)):
+            samples = sorted(self.latencies[route])
+            if len(samples) >= 2:
+                cuts = statistics.quantiles(samples, n=100, method='inclusive')
+                p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+            else:
+                p50 = p95 = p99 = samples[0] if samples else 0.0
+            print(f'{route:<36}{self.successes[route]:>7}{self.errors[route]:>6}{len(samples) / elapsed:>9.1f}'
+                  f'{p50 * 1000:>9.1f}{p95 * 1000:>9.1f}{p99 * 1000:>9.1f}')
+
+
+async def _user_session(client, recorder, provider, user_id, args):
+    """Connect one user to a provider through OAuth, then load items repeatedly."""
+    form = {'user_id': user_id, 'org_id': 'loadtest'}
+    response = await recorder.call(
+        f'POST /{provider}/authorize',
+        client.post(f'/integrations/{provider}/authorize', data=form)
+    )
+    if response is None:
+        return
+    state = parse_qs(urlparse(response.json()).query)['state'][0]
+
+    response = await recorder.call(
+        f'GET /{provider}/oauth2callback',
+        client.get(f'/integrations/{provider}/oauth2callback', params={'code': 'loadtest', 'state': state})
+    )
+    if response is None:
+        return
+
+    response = await recorder.call(
+        f'POST /{provider}/credentials',
+        client.post(f'/integrations/{provider}/credentials', data=form)
+    )
+    if response is None:
+        return
+
+    # Loads use the credentials stored by the callback
+    for _ in range(args.loads):
+        data = dict(form)
+        if args.refresh:
+            data['refresh'] = 'true'
+        if args.stream:
+            data['stream'] = 'true'
+        await recorder.call(
+            f'POST /{provider}/load',
+            client.post(f'/integrations/{provider}/load', data=data)
+        )
+
+    if args.records and provider == 'airtable':
+        await recorder.call(
+            'POST /airtable/records',
+            client.post('/integrations/airtable/records', data=form)
+        )
+
+
+async def _wait_until_up(client, url, timeout=15.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f'{url} did not come up')
+
+
+async def _run(args):
+    import httpx
+    import uvicorn
+
+    import api
+    import redis_client
+
+    if args.fake_redis:
+        import fakeredis
+        redis_client.redis_client = fakeredis.aioredis.FakeRedis()
+
+    server = uvicorn.Server(uvicorn.Config(api.app, host='127.0.0.1', port=args.api_port,
+                                           log_level='warning'))
+    server_task = asyncio.create_task(server.serve())
+
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.users * len(args.providers))
+    async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{args.api_port}',
+                                 timeout=args.timeout, limits=limits) as client:
+        await _wait_until_up(client, f'http://127.0.0.1:{args.mock_port}/health')
+        await _wait_until_up(client, '/')
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            _user_session(client, recorder, provider, f'user{i}', args)
+            for provider in args.providers
+            for i in range(args.users)
+        ))
+        elapsed = time.perf_counter() - start
+
+    server.should_exit = True
+    await server_task
+    print(f'{args.users} users x {len(args.providers)} providers, {args.loads} loads each, '
+          f'{elapsed:.2f}s')
+    recorder.report(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10, help='concurrent users per provider')
+    parser.add_argument('--loads', type=int, default=3, help='/load calls per user')
+    parser.add_argument('--providers', default=','.join(_PROVIDERS))
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='mock provider latency')
+    parser.add_argument('--pages', type=int, default=2, help='pages per mock provider listing')
+    parser.add_argument('--tables-per-base', type=int, default=3)
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='fraction of mock provider responses that are 429s')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--refresh', action='store_true', help='bypass the /load cache')
+    parser.add_argument('--stream', action='store_true', help='use NDJSON streaming loads')
+    parser.add_argument('--records', action='store_true', help='also stream every Airtable record once')
+    parser.add_argument('--fake-redis', action='store_true')
+    parser.add_argument('--respect-rate-limits', action='store_true')
+    parser.add_argument('--api-port', type=int, default=8001)
+    parser.add_argument('--mock-port', type=int, default=8100)
+    parser.add_argument('--timeout', type=float, default=120.0)
+    args = parser.parse_args()
+    args.providers = [p for p in args.providers.split(',') if p]
+
+    # config.py reads the environment at import, so set it before importing api
+    os.environ.update(provider_env(f'http://127.0.0.1:{args.mock_port}'))
+    if not os.getenv('CREDENTIALS_ENCRYPTION_KEYS'):
+        from cryptography.fernet import Fernet
+        os.environ['CREDENTIALS_ENCRYPTION_KEYS'] = Fernet.generate_key().decode()
+    if not args.respect_rate_limits:
+        for provider in _PROVIDERS:
+            os.environ[f'{provider.upper()}_RATE_LIMIT'] = '1000000'
+            os.environ[f'{provider.upper()}_RATE_BURST'] = '1000000'
+        os.environ['AIRTABLE_TABLE_CONCURRENCY'] = '1000'
+
+    mock = subprocess.Popen(
+        [sys.executable, '-m', 'loadtest.mock_providers',
+         '--port', str(args.mock_port),
+         '--latency-ms', str(args.latency_ms),
+         '--pages', str(args.pages),
+         '--tables-per-base', str(args.tables_per_base),
+         '--throttle-rate', str(args.throttle_rate),
+         '--retry-after', str(args.retry_after)],
+        cwd=_BACKEND_DIR
+    )
+    try:
+        asyncio.run(_run(args))
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+if __name__ == '__main__':
+    main()
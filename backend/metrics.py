@@ -0,0 +1,249 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import logging
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+_COUNT_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 500000)
+
+REQUEST_LATENCY = Histogram(
+    'integrations_http_request_duration_seconds',
+    'Latency of API requests by route.',
+    ['method', 'route', 'status'],
+    buckets=_LATENCY_BUCKETS
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    'integrations_http_requests_in_progress',
+    'API requests currently being served by route.',
+    ['method', 'route'],
+    multiprocess_mode='livesum'
+)
+UPSTREAM_LATENCY = Histogram(
+    'integrations_upstream_request_duration_seconds',
+    'Latency of provider API calls.',
+    ['provider', 'method', 'status'],
+    buckets=_LATENCY_BUCKETS
+)
+UPSTREAM_IN_PROGRESS = Gauge(
+    'integrations_upstream_requests_in_progress',
+    'Provider API calls currently in flight.',
+    ['provider'],
+    multiprocess_mode='livesum'
+)
+UPSTREAM_PAGES = Counter(
+    'integrations_upstream_pages_total',
+    'Result pages fetched from provider APIs.',
+    ['provider']
+)
+LOAD_PAGES = Histogram(
+    'integrations_load_pages',
+    'Upstream result pages fetched per load.',
+    ['provider', 'mode'],
+    buckets=_COUNT_BUCKETS
+)
+LOAD_ITEMS = Histogram(
+    'integrations_load_items',
+    'Items returned per load.',
+    ['provider', 'mode'],
+    buckets=_COUNT_BUCKETS
+)
+REDIS_LATENCY = Histogram(
+    'integrations_redis_operation_duration_seconds',
+    'Latency of Redis helper calls.',
+    ['operation', 'status'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+)
+OFFLOADED_PAGES = Counter(
+    'integrations_offloaded_pages_total',
+    'Upstream pages decoded in the offload executor.',
+    ['provider']
+)
+EVENT_LOOP_LAG = Histogram(
+    'integrations_event_loop_lag_seconds',
+    'Delay of event loop wakeups past their scheduled time.',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+
+# Page counter for the load running in the current context, if any
+_load_pages = contextvars.ContextVar('load_pages', default=None)
+
+
+def _get_route(app, scope):
+    """Return the route template matching a request, to keep label cardinality low."""
+    for route in app.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return 'unmatched'
+
+
+async def _finish_after(body, finish, status):
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        finish(status)
+
+
+def instrument_app(app):
+    """Record latency, status and in-flight requests for every API route.
+
+    Requests are observed once their body has been sent, so streamed NDJSON
+    responses are timed in full rather than to their first byte.
+    """
+
+    @app.middleware('http')
+    async def _record_request(request, call_next):
+        method = request.method
+        route = _get_route(app, request.scope)
+        in_progress = REQUESTS_IN_PROGRESS.labels(method, route)
+        start = time.perf_counter()
+        in_progress.inc()
+
+        def _finish(status):
+            in_progress.dec()
+            REQUEST_LATENCY.labels(method, route, status).observe(time.perf_counter() - start)
+
+        try:
+            response = await call_next(request)
+        except BaseException:
+            _finish('500')
+            raise
+        response.body_iterator = _finish_after(
+            response.body_iterator, _finish, str(response.status_code)
+        )
+        return response
+
+
+def timed_upstream(fn):
+    """Time a ``(provider, method, ...)`` coroutine that returns an httpx response."""
+
+    @functools.wraps(fn)
+    async def wrapper(provider, method, *args, **kwargs):
+        in_progress = UPSTREAM_IN_PROGRESS.labels(provider)
+        status = 'error'
+        start = time.perf_counter()
+        in_progress.inc()
+        try:
+            response = await fn(provider, method, *args, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            in_progress.dec()
+            UPSTREAM_LATENCY.labels(provider, method, status).observe(time.perf_counter() - start)
+
+    return wrapper
+
+
+def count_page(provider):
+    """Record one upstream result page against the provider and current load."""
+    UPSTREAM_PAGES.labels(provider).inc()
+    pages = _load_pages.get()
+    if pages is not None:
+        pages[0] += 1
+
+
+def counted_pages(provider):
+    """Count the pages yielded by an async generator of upstream results."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            async for page in fn(*args, **kwargs):
+                count_page(provider)
+                yield page
+
+        return wrapper
+
+    return decorator
+
+
+def timed_redis(fn):
+    """Time a Redis helper coroutine, labelled by its name.
+
+    Only helpers that issue commands themselves are timed, so no round trip
+    is observed twice.
+    """
+    operation = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        status = 'error'
+        start = time.perf_counter()
+        try:
+            result = await fn(*args, **kwargs)
+            status = 'ok'
+            return result
+        finally:
+            REDIS_LATENCY.labels(operation, status).observe(time.perf_counter() - start)
+
+    return wrapper
+
+
+class LoadStats:
+    """Outcome of a load, filled in by the caller of ``track_load``."""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.items = 0
+
+
+@contextlib.contextmanager
+def track_load(provider, mode):
+    """Observe the upstream pages fetched and items returned by one load."""
+    pages = [0]
+    stats = LoadStats(mode)
+    # Restore by value rather than token: streamed loads may finish in a
+    # different context from the one they started in
+    previous = _load_pages.get()
+    _load_pages.set(pages)
+    try:
+        yield stats
+    finally:
+        _load_pages.set(previous)
+        LOAD_PAGES.labels(provider, stats.mode).observe(pages[0])
+        LOAD_ITEMS.labels(provider, stats.mode).observe(stats.items)
+
+
+async def monitor_loop_lag(interval, target):
+    """Sample event loop lag every ``interval`` seconds until cancelled.
+
+    Lag is how late a sleep wakes up, i.e. how long callbacks ran without
+    yielding. Samples above ``target`` are also logged.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - start - interval, 0.0)
+        EVENT_LOOP_LAG.observe(lag)
+        if lag > target:
+            logger.warning('Event loop lagged %.0f ms (target %.0f ms)', lag * 1000, target * 1000)
+
+
+def render():
+    """Return the exposition body and content type for /metrics.
+
+    With PROMETHEUS_MULTIPROC_DIR set, samples from every worker are merged.
+    """
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
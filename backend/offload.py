@@ -0,0 +1,81 @@
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import metrics
+from config import offload as offload_config
+
+_executor = None
+# Threads for work whose result stays in this worker, when pages go to processes
+_thread_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        if offload_config['executor'] == 'process':
+            # Spawned rather than forked: the worker already runs threads
+            _executor = ProcessPoolExecutor(
+                max_workers=offload_config['workers'],
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        else:
+            _executor = ThreadPoolExecutor(
+                max_workers=offload_config['workers'],
+                thread_name_prefix='offload'
+            )
+    return _executor
+
+
+def _get_thread_executor():
+    global _thread_executor
+    if offload_config['executor'] != 'process':
+        return _get_executor()
+    if _thread_executor is None:
+        _thread_executor = ThreadPoolExecutor(
+            max_workers=offload_config['workers'],
+            thread_name_prefix='offload'
+        )
+    return _thread_executor
+
+
+def shutdown():
+    """Stop the executors, dropping work still waiting to run."""
+    global _executor, _thread_executor
+    for executor in (_executor, _thread_executor):
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+    _executor = _thread_executor = None
+
+
+async def decode(provider, convert, content, *args):
+    """Return ``convert(content, *args)`` for an upstream response body.
+
+    ``convert`` decodes the JSON body and builds what the caller needs from
+    it. Bodies of at least OFFLOAD_THRESHOLD_BYTES run in the executor so
+    they do not stall other requests; smaller ones cost less to decode
+    inline than to hand over. With a process pool, ``convert`` must be a
+    module-level function and its result is pickled back, so it should
+    return compact items rather than the decoded tree.
+    """
+    if offload_config['executor'] == 'none' or len(content) < offload_config['threshold_bytes']:
+        return convert(content, *args)
+    metrics.OFFLOADED_PAGES.labels(provider).inc()
+    return await asyncio.get_running_loop().run_in_executor(
+        _get_executor(), functools.partial(convert, content, *args)
+    )
+
+
+async def compute(fn, *args):
+    """Return ``fn(*args)``, computed on an offload thread.
+
+    For CPU-heavy work whose result stays in this worker, such as search
+    indexes. Results are never pickled, so with a process executor this
+    runs on threads of its own; with ``none`` it runs inline.
+    """
+    if offload_config['executor'] == 'none':
+        return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(
+        _get_thread_executor(), functools.partial(fn, *args)
+    )
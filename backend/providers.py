@@ -0,0 +1,35 @@
+import importlib
+
+# Display names of the supported providers, keyed by their integration module
+PROVIDERS = {
+    'airtable': 'Airtable',
+    'notion': 'Notion',
+    'hubspot': 'HubSpot'
+}
+
+# Handler name templates every integration module follows
+_HANDLERS = {
+    'authorize': 'authorize_{}',
+    'oauth2callback': 'oauth2callback_{}',
+    'credentials': 'get_{}_credentials',
+    'get_items': 'get_items_{}',
+    'iter_items': 'iter_items_{}',
+    'get_changed_items': 'get_changed_items_{}',
+    'refresh_token': 'refresh_{}_token',
+    'iter_records': 'iter_records_{}'
+}
+
+# Handlers a provider may leave out
+_OPTIONAL_HANDLERS = {'get_changed_items', 'refresh_token', 'iter_records'}
+
+
+def get_handler(provider, name):
+    """Return a provider's handler, importing its integration module on first use.
+
+    Returns None for optional handlers the provider does not implement.
+    """
+    module = importlib.import_module(f'integrations.{provider}')
+    handler = getattr(module, _HANDLERS[name].format(provider), None)
+    if handler is None and name not in _OPTIONAL_HANDLERS:
+        raise AttributeError(f'integrations.{provider} does not define {_HANDLERS[name].format(provider)}')
+    return handler
@@ -0,0 +1,153 @@
+import base64
+import binascii
+import hashlib
+from datetime import timezone
+
+import orjson
+from fastapi import HTTPException
+
+from loader import parse_timestamp
+
+# Item fields /load results can be sorted by; prefix with '-' for descending
+SORT_FIELDS = ('last_modified_time', 'creation_time', 'name')
+
+_TIME_FIELDS = {'last_modified_time', 'creation_time'}
+
+
+def _digest(parts):
+    return hashlib.blake2b('\x1f'.join(parts).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def query_fingerprint(item_type=None, name_prefix=None, sort=None):
+    """Identify the filter and sort a cursor was issued for."""
+    return _digest([item_type or '', name_prefix or '', sort or ''])
+
+
+def result_fingerprint(items):
+    """Identify a filtered and sorted result by the items it holds, in order."""
+    return _digest(f'{item.type}\x1e{item.id}' for item in items)
+
+
+def encode_cursor(offset, query, result):
+    """Return an opaque cursor for the page starting at offset of a query result."""
+    payload = {'offset': offset, 'query': query, 'result': result}
+    return base64.urlsafe_b64encode(orjson.dumps(payload)).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Return the offset, query and result fingerprints encoded in a cursor.
+
+    Malformed cursors raise a 400.
+    """
+    try:
+        payload = orjson.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        offset, query, result = payload['offset'], payload['query'], payload['result']
+    except (binascii.Error, orjson.JSONDecodeError, KeyError, TypeError, UnicodeEncodeError):
+        raise HTTPException(status_code=400, detail='Invalid cursor.')
+    if not isinstance(offset, int) or offset < 0:
+        raise HTTPException(status_code=400, detail='Invalid cursor.')
+    return offset, query, result
+
+
+def filter_items(items, item_types=None, name_prefix=None):
+    """Keep items of the given types (case-insensitive) whose name starts with name_prefix."""
+    if item_types:
+        types = {item_type.strip().casefold() for item_type in item_types.split(',')}
+        items = [item for item in items if item.type and item.type.casefold() in types]
+    if name_prefix:
+        prefix = name_prefix.casefold()
+        items = [item for item in items if item.name and item.name.casefold().startswith(prefix)]
+    return items
+
+
+def sort_items(items, sort):
+    """Sort items by one of SORT_FIELDS, placing items without a value last.
+
+    Ties keep the load order, so repeated queries page consistently.
+    """
+    descending = sort.startswith('-')
+    field = sort.lstrip('-')
+    if field not in SORT_FIELDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"sort must be one of {', '.join(SORT_FIELDS)}, optionally prefixed with '-'."
+        )
+
+    if field in _TIME_FIELDS:
+        def _value(item):
+            value = parse_timestamp(getattr(item, field))
+            # Providers may return naive timestamps; treat them as UTC
+            if value is not None and value.tzinfo is None:
+                value = value.replace(tzinfo=timezone.utc)
+            return value
+    else:
+        def _value(item):
+            name = getattr(item, field)
+            return name.casefold() if name else None
+
+    keyed = [(_value(item), item) for item in items]
+    present = [pair for pair in keyed if pair[0] is not None]
+    missing = [item for value, item in keyed if value is None]
+    present.sort(key=lambda pair: pair[0], reverse=descending)
+    return [item for _, item in present] + missing
+
+
+class QueryResult:
+    """Filtered and sorted load results, fingerprinted once for their cursors."""
+
+    __slots__ = ('items', 'query', 'result')
+
+    def __init__(self, items, query, result):
+        self.items = items
+        self.query = query
+        self.result = result
+
+
+def run_query(items, item_type=None, name_prefix=None, sort=None):
+    """Filter and sort load results into a QueryResult."""
+    query = query_fingerprint(item_type, name_prefix, sort)
+    items = filter_items(items, item_type, name_prefix)
+    if sort:
+        items = sort_items(items, sort)
+    return QueryResult(items, query, result_fingerprint(items))
+
+
+def paginate(items, limit, cursor=None, query=None, result=None):
+    """Return one page of items and the cursor of the next page, or None at the end.
+
+    Cursors only continue the query (``query_fingerprint``) and result
+    (``result_fingerprint``, computed from items unless given) they were
+    issued for: a cursor from another filter or sort is rejected with a
+    400, and one whose result has since changed (the cache expired or was
+    refreshed) with a 409, rather than skipping or repeating items.
+    """
+    if limit < 1:
+        raise HTTPException(status_code=400, detail='limit must be at least 1.')
+    if result is None:
+        result = result_fingerprint(items)
+    offset = 0
+    if cursor:
+        offset, cursor_query, cursor_result = decode_cursor(cursor)
+        if cursor_query != query:
+            raise HTTPException(status_code=400, detail='Cursor does not match this query.')
+        if cursor_result != result:
+            raise HTTPException(
+                status_code=409,
+                detail='Results changed since the cursor was issued; start again without it.'
+            )
+    end = offset + limit
+    return items[offset:end], encode_cursor(end, query, result) if end < len(items) else None
+
+
+def page_result(result, limit=None, cursor=None):
+    """Return a QueryResult's items, or one page of them.
+
+    Without ``limit`` the items are returned as a list; with it a
+    ``{'items': ..., 'next_cursor': ...}`` page is returned.
+    """
+    if limit is None:
+        if cursor:
+            raise HTTPException(status_code=400, detail='cursor requires limit.')
+        return result.items
+    page, next_cursor = paginate(result.items, limit, cursor, result.query, result.result)
+    return {'items': page, 'next_cursor': next_cursor}
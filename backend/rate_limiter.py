@@ -0,0 +1,121 @@
+import asyncio
+import contextlib
+import random
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+import http_client
+import metrics
+import redis_client
+from config import rate_limits
+
+
+def _get_bucket(provider, access_token=None, scope=None):
+    """Return the shared bucket key and limit of a request.
+
+    Data requests draw from a bucket per provider, access token and optional
+    sub-scope. Requests without an access token are OAuth code exchanges and
+    token refreshes; they share one app-wide bucket per provider, limited by
+    ``rate_limits['oauth']`` rather than the provider's data API rate.
+    """
+    if access_token is None:
+        return f'ratelimit:{provider}:oauth', rate_limits['oauth']
+    key = f'ratelimit:{provider}:{redis_client.token_fingerprint(access_token)}'
+    return f'{key}:{scope}' if scope else key, rate_limits[provider]
+
+
+async def _reserve(limit, key, penalty=0):
+    return await redis_client.reserve_token(key, limit['rate'], limit['burst'], penalty)
+
+
+def _get_retry_after(response):
+    """Return the Retry-After delay of a response in seconds, if it has one."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def _get_backoff(response, attempt):
+    """Return how long a throttled request should hold off its bucket."""
+    retry_after = _get_retry_after(response)
+    if retry_after is not None:
+        return retry_after
+    backoff = min(rate_limits['backoff_base'] * 2 ** attempt, rate_limits['backoff_max'])
+    return random.uniform(backoff / 2, backoff)
+
+
+@metrics.timed_upstream
+async def _send(provider, method, url, **kwargs):
+    return await http_client.get_client(provider).request(method, url, **kwargs)
+
+
+# Timed up to the response headers; the caller reads the body
+@metrics.timed_upstream
+async def _open(provider, method, url, **kwargs):
+    client = http_client.get_client(provider)
+    return await client.send(client.build_request(method, url, **kwargs), stream=True)
+
+
+async def _pace(limit, key, jitter):
+    wait = await _reserve(limit, key) + jitter
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+
+async def request(provider, method, url, access_token=None, scope=None, **kwargs):
+    """Send a provider request through its shared rate limiter.
+
+    Each (provider, access token, scope) pair draws from a Redis token bucket,
+    so every uvicorn worker paces against the same budget; requests without
+    an access token use the provider's OAuth bucket. A 429 holds the
+    whole bucket for its Retry-After (or an exponential backoff) before the
+    request is retried with added jitter.
+    """
+    key, limit = _get_bucket(provider, access_token, scope)
+    jitter = 0.0
+
+    for attempt in range(rate_limits['max_retries'] + 1):
+        await _pace(limit, key, jitter)
+
+        response = await _send(provider, method, url, **kwargs)
+        if response.status_code != 429 or attempt == rate_limits['max_retries']:
+            return response
+
+        await _reserve(limit, key, _get_backoff(response, attempt))
+        jitter = random.uniform(0, rate_limits['jitter'])
+
+
+@contextlib.asynccontextmanager
+async def stream(provider, method, url, access_token=None, scope=None, **kwargs):
+    """Like ``request``, but yield the response before its body is read.
+
+    The body can then be consumed incrementally with ``aiter_bytes``; the
+    connection is released when the block exits. Throttled responses are
+    closed unread and retried as ``request`` does.
+    """
+    key, limit = _get_bucket(provider, access_token, scope)
+    jitter = 0.0
+
+    for attempt in range(rate_limits['max_retries'] + 1):
+        await _pace(limit, key, jitter)
+
+        response = await _open(provider, method, url, **kwargs)
+        if response.status_code != 429 or attempt == rate_limits['max_retries']:
+            try:
+                yield response
+            finally:
+                await response.aclose()
+            return
+
+        await response.aclose()
+        await _reserve(limit, key, _get_backoff(response, attempt))
+        jitter = random.uniform(0, rate_limits['jitter'])
@@ -1,47 +1,344 @@
+import asyncio
+import hashlib
+import secrets
+import time
+import zlib
 import redis.asyncio as redis
-from kombu.utils.url import safequote
-from config import redis as redis_config
+from redis.commands.core import AsyncScript
+from urllib.parse import quote
+from metrics import timed_redis
+from config import redis as redis_config, cache as cache_config
+from integrations.integration_item import serialize_items, deserialize_items
 
 
 def get_redis_client():
-    host = safequote(redis_config['host'])
+    host = quote(redis_config['host'], safe='')
     return redis.Redis(
         host=host,
         port=redis_config['port'],
-        db=0
+        db=0,
+        max_connections=redis_config['max_connections'],
+        health_check_interval=redis_config['health_check_interval'],
+        socket_timeout=redis_config['socket_timeout'],
+        socket_connect_timeout=redis_config['socket_connect_timeout']
     )
 
 
-redis_client = get_redis_client()
+# Created on first use so importing this module does not build a pool;
+# tests and tools may assign their own client here
+redis_client = None
 
 
-async def add_key_value(key, value, expire=None):
+def _get_client():
+    global redis_client
+    if redis_client is None:
+        redis_client = get_redis_client()
+    return redis_client
+
+
+@timed_redis
+async def add_key_value(key, value, expire=None, keep_ttl=False):
     try:
-        await redis_client.set(key, value)
-        if expire:
-            await redis_client.expire(key, expire)
+        await _get_client().set(key, value, ex=expire, keepttl=keep_ttl)
     except redis.RedisError as e:
         raise Exception(f"Redis set failed: {str(e)}")
 
 
+@timed_redis
 async def get_value(key):
     try:
-        return await redis_client.get(key)
+        return await _get_client().get(key)
     except redis.RedisError as e:
         raise Exception(f"Redis get failed: {str(e)}")
 
 
+@timed_redis
+async def get_and_delete_value(key):
+    """Atomically read and remove a key with GETDEL."""
+    try:
+        return await _get_client().getdel(key)
+    except redis.RedisError as e:
+        raise Exception(f"Redis getdel failed: {str(e)}")
+
+
+@timed_redis
 async def delete_key(key):
     try:
-        await redis_client.delete(key)
+        await _get_client().delete(key)
     except redis.RedisError as e:
         raise Exception(f"Redis delete failed: {str(e)}")
 
 
-def _get_redis_client():
-    host = safequote(redis_config['host'])
-    return redis.Redis(
-        host=host,
-        port=redis_config['port'],
-        db=0
+@timed_redis
+async def mset_with_ttl(mapping, expire=None):
+    """Set several keys with the same TTL in one pipelined round trip."""
+    try:
+        async with _get_client().pipeline(transaction=False) as pipe:
+            for key, value in mapping.items():
+                pipe.set(key, value, ex=expire)
+            await pipe.execute()
+    except redis.RedisError as e:
+        raise Exception(f"Redis mset failed: {str(e)}")
+
+
+@timed_redis
+async def mget(keys, delete=False):
+    """Read several keys in one pipelined round trip, optionally with GETDEL."""
+    try:
+        async with _get_client().pipeline(transaction=False) as pipe:
+            for key in keys:
+                if delete:
+                    pipe.getdel(key)
+                else:
+                    pipe.get(key)
+            return await pipe.execute()
+    except redis.RedisError as e:
+        raise Exception(f"Redis mget failed: {str(e)}")
+
+
+@timed_redis
+async def add_to_sorted_set(key, member, score):
+    """Add or rescore a sorted set member."""
+    try:
+        await _get_client().zadd(key, {member: score})
+    except redis.RedisError as e:
+        raise Exception(f"Redis zadd failed: {str(e)}")
+
+
+@timed_redis
+async def get_sorted_set_range(key, max_score, limit=None):
+    """Return members scored at or below max_score, lowest first."""
+    try:
+        return await _get_client().zrangebyscore(
+            key, '-inf', max_score, start=0 if limit else None, num=limit
+        )
+    except redis.RedisError as e:
+        raise Exception(f"Redis zrangebyscore failed: {str(e)}")
+
+
+@timed_redis
+async def remove_from_sorted_set(key, member):
+    try:
+        await _get_client().zrem(key, member)
+    except redis.RedisError as e:
+        raise Exception(f"Redis zrem failed: {str(e)}")
+
+
+# Scripts are hashed once here and loaded into Redis on first use
+_RELEASE_LOCK_SCRIPT = AsyncScript(None, b"""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+_EXTEND_LOCK_SCRIPT = AsyncScript(None, b"""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+""")
+
+
+@timed_redis
+async def acquire_lock(key, token, expire):
+    """Take a lock with SET NX EX, returning whether it was acquired."""
+    try:
+        return bool(await _get_client().set(key, token, nx=True, ex=expire))
+    except redis.RedisError as e:
+        raise Exception(f"Redis lock failed: {str(e)}")
+
+
+@timed_redis
+async def extend_lock(key, token, expire):
+    """Push back a lock's expiry if it is still held with the given token."""
+    try:
+        return bool(await _EXTEND_LOCK_SCRIPT(
+            keys=[key], args=[token, expire], client=_get_client()
+        ))
+    except redis.RedisError as e:
+        raise Exception(f"Redis lock extend failed: {str(e)}")
+
+
+@timed_redis
+async def release_lock(key, token):
+    """Release a lock only if it is still held with the given token."""
+    try:
+        await _RELEASE_LOCK_SCRIPT(keys=[key], args=[token], client=_get_client())
+    except redis.RedisError as e:
+        raise Exception(f"Redis unlock failed: {str(e)}")
+
+
+# Reserves one token (or applies a penalty after a 429) and returns how many
+# seconds the caller must wait. Tokens may go negative, which queues callers
+# fairly across workers. Redis server time keeps every worker on one clock.
+_TOKEN_BUCKET_SCRIPT = AsyncScript(None, b"""
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local penalty = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+if penalty > 0 then
+    tokens = math.min(tokens, -penalty * rate)
+else
+    tokens = tokens - 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate) + 1)
+if tokens >= 0 then
+    return '0'
+end
+return tostring(-tokens / rate)
+""")
+
+
+@timed_redis
+async def reserve_token(key, rate, capacity, penalty=0):
+    """Take a token from a shared bucket and return the seconds to wait for it."""
+    try:
+        wait = await _TOKEN_BUCKET_SCRIPT(
+            keys=[key], args=[rate, capacity, penalty], client=_get_client()
+        )
+    except redis.RedisError as e:
+        raise Exception(f"Redis token bucket failed: {str(e)}")
+    return float(wait)
+
+
+def token_fingerprint(access_token):
+    """Return a stable, non-reversible identifier for an access token."""
+    return hashlib.sha256(access_token.encode('utf-8')).hexdigest()
+
+
+def _item_cache_key(provider, access_token):
+    return f'items:{provider}:{token_fingerprint(access_token)}'
+
+
+def decode_items(payload):
+    """Rebuild IntegrationItems from a cached or snapshot payload, None for a miss."""
+    if payload is None:
+        return None
+    return deserialize_items(zlib.decompress(payload))
+
+
+def encode_items(items):
+    """Compress IntegrationItems for the item cache and snapshots."""
+    return zlib.compress(serialize_items(items), cache_config['compress_level'])
+
+
+def decompress_items(payload):
+    """Return the JSON array of a cached payload and the number of items in it."""
+    data = zlib.decompress(payload)
+    # Items serialize with their id first and strings escape quotes, so
+    # this sequence only ever starts an item
+    return data, data.count(b'{"id":')
+
+
+async def get_cached_payload(provider, access_token):
+    """Return the compressed cached items of a provider token, or None."""
+    return await get_value(_item_cache_key(provider, access_token))
+
+
+async def set_cached_items(provider, access_token, items):
+    """Cache IntegrationItems for a provider token using its configured TTL."""
+    ttl = cache_config['ttl'].get(provider)
+    if not ttl:
+        return
+    await add_key_value(_item_cache_key(provider, access_token), encode_items(items), expire=ttl)
+
+
+def _snapshot_key(provider, org_id, user_id):
+    return f'sync_snapshot:{provider}:{org_id}:{user_id}'
+
+
+def _watermark_key(provider, org_id, user_id):
+    return f'sync_watermark:{provider}:{org_id}:{user_id}'
+
+
+def _snapshot_version_key(provider, org_id, user_id):
+    return f'sync_version:{provider}:{org_id}:{user_id}'
+
+
+def _full_sync_key(provider, org_id, user_id):
+    return f'sync_full:{provider}:{org_id}:{user_id}'
+
+
+def _sync_time_key(provider, org_id, user_id):
+    return f'sync_time:{provider}:{org_id}:{user_id}'
+
+
+async def get_snapshot(provider, org_id, user_id):
+    """Return the last synced items, watermark, version and full sync time.
+
+    The full sync time is the Unix time of the last sync that fetched every
+    item rather than only changed ones.
+    """
+    payload, watermark, version, full_synced_at = await mget([
+        _snapshot_key(provider, org_id, user_id),
+        _watermark_key(provider, org_id, user_id),
+        _snapshot_version_key(provider, org_id, user_id),
+        _full_sync_key(provider, org_id, user_id)
+    ])
+    if watermark is not None:
+        watermark = watermark.decode('utf-8')
+    if version is not None:
+        version = version.decode('utf-8')
+    if full_synced_at is not None:
+        full_synced_at = float(full_synced_at)
+    return decode_items(payload), watermark, version, full_synced_at
+
+
+async def get_snapshot_payload(provider, org_id, user_id):
+    """Return a user's snapshot still encoded, with its version, for decoding elsewhere."""
+    payload, version = await mget([
+        _snapshot_key(provider, org_id, user_id),
+        _snapshot_version_key(provider, org_id, user_id)
+    ])
+    return payload, version.decode('utf-8') if version is not None else None
+
+
+async def get_snapshot_state(provider, org_id, user_id):
+    """Return the version and sync time of a user's stored snapshot.
+
+    The version is None if there is no snapshot, and the sync time (Unix
+    time of the sync that stored it) None if it is not recorded.
+    """
+    version, synced_at = await mget([
+        _snapshot_version_key(provider, org_id, user_id),
+        _sync_time_key(provider, org_id, user_id)
+    ])
+    return (
+        version.decode('utf-8') if version is not None else None,
+        float(synced_at) if synced_at is not None else None
     )
+
+
+async def set_snapshot(provider, org_id, user_id, items, watermark, full_synced_at=None):
+    """Store the synced items and their last-modified watermark.
+
+    ``full_synced_at`` is recorded when the sync fetched every item. Returns
+    a new random version for the snapshot, which in-process views of it use
+    to tell whether they are current.
+    """
+    ttl = cache_config['snapshot_ttl']
+    version = secrets.token_hex(8)
+    mapping = {
+        _snapshot_key(provider, org_id, user_id): encode_items(items),
+        _snapshot_version_key(provider, org_id, user_id): version,
+        _sync_time_key(provider, org_id, user_id): repr(time.time())
+    }
+    if full_synced_at is not None:
+        mapping[_full_sync_key(provider, org_id, user_id)] = repr(full_synced_at)
+    watermark_key = _watermark_key(provider, org_id, user_id)
+    if watermark is None:
+        await asyncio.gather(
+            mset_with_ttl(mapping, expire=ttl),
+            delete_key(watermark_key)
+        )
+    else:
+        mapping[watermark_key] = watermark
+        await mset_with_ttl(mapping, expire=ttl)
+    return version
@@ -0,0 +1,356 @@
+import asyncio
+import bisect
+import heapq
+import re
+from collections import OrderedDict
+from operator import itemgetter
+
+import offload
+import redis_client
+from config import search as search_config
+
+_TOKEN_RE = re.compile(r'\w+')
+# Candidate sets up to this size are ranked directly instead of walked in name order
+_SCAN_LIMIT = 2048
+_EMPTY = frozenset()
+# Most items a search walks in rank order before sorting its candidates instead
+_WALK_LIMIT = 10_000
+# Sorts after every token sharing a prefix, bounding prefix ranges
+_MAX_CHAR = chr(0x10FFFF)
+
+# In-process indexes: (provider, org_id, user_id) -> SearchIndex
+_indexes = OrderedDict()
+# Index builds in flight: (provider, org_id, user_id) -> Task
+_builds = {}
+
+
+def tokenize(text):
+    """Split text into casefolded word tokens."""
+    return _TOKEN_RE.findall(text.casefold()) if text else []
+
+
+class SearchIndex:
+    """Token and prefix inverted index over IntegrationItem names and types.
+
+    Items are keyed on (type, id) like sync snapshots. Tokens are kept in a
+    sorted vocabulary so prefix lookups are a bisect plus a range scan, and
+    every item is kept in rank order so searches of broad terms can stop
+    early. Candidates of narrower terms are sorted once and cached, up to
+    SEARCH_ORDERED_ENTRIES keys per index.
+    """
+
+    def __init__(self, version=None):
+        self.version = version
+        self._items = {}
+        self._tokens = {}
+        self._order = {}
+        self._postings = {}
+        self._ranked = []
+        self._ordered = OrderedDict()
+        self._ordered_entries = 0
+        self._vocabulary = []
+
+    def __len__(self):
+        return len(self._items)
+
+    def _prefixes(self, key):
+        # Cached term orders that hold this item
+        prefixes = {token[:end] for token in self._tokens[key] for end in range(1, len(token) + 1)}
+        return prefixes.intersection(self._ordered)
+
+    def _insert(self, ordered, key):
+        bisect.insort(ordered, key, key=self._order.__getitem__)
+
+    def _delete(self, ordered, key):
+        index = bisect.bisect_left(ordered, self._order[key], key=self._order.__getitem__)
+        while ordered[index] != key:
+            index += 1
+        del ordered[index]
+
+    def _unlink(self, key, ranked=True):
+        if key not in self._items:
+            return
+        if ranked:
+            self._delete(self._ranked, key)
+        if self._ordered:
+            for term in self._prefixes(key):
+                self._delete(self._ordered[term], key)
+                self._ordered_entries -= 1
+        for token in self._tokens.pop(key):
+            posting = self._postings[token]
+            posting.discard(key)
+            if not posting:
+                # Left in the vocabulary; prefix scans skip tokens without postings
+                del self._postings[token]
+        del self._items[key]
+        del self._order[key]
+
+    def add(self, items):
+        """Index items, replacing earlier versions of the same items."""
+        # Bulk loads re-sort once rather than inserting item by item
+        bulk = len(items) * 8 > len(self._items)
+        if bulk:
+            self._ordered.clear()
+            self._ordered_entries = 0
+        new_tokens = []
+        for item in items:
+            key = (item.type, item.id)
+            self._unlink(key, ranked=not bulk)
+            tokens = tuple(dict.fromkeys(tokenize(item.name) + tokenize(item.type)))
+            name = (item.name or '').casefold()
+            self._items[key] = item
+            self._tokens[key] = tokens
+            self._order[key] = (len(name), name)
+            for token in tokens:
+                posting = self._postings.get(token)
+                if posting is None:
+                    posting = self._postings[token] = set()
+                    new_tokens.append(token)
+                posting.add(key)
+            if not bulk:
+                self._insert(self._ranked, key)
+                if self._ordered:
+                    for term in self._prefixes(key):
+                        self._insert(self._ordered[term], key)
+                        self._ordered_entries += 1
+        if bulk:
+            self._ranked = sorted(self._items, key=self._order.__getitem__)
+
+        new_tokens = [token for token in new_tokens if token in self._postings]
+        vocabulary = self._vocabulary
+        if bulk or len(new_tokens) * 8 > len(vocabulary):
+            self._vocabulary = sorted(set(vocabulary).union(new_tokens))
+        else:
+            for token in new_tokens:
+                index = bisect.bisect_left(vocabulary, token)
+                if index == len(vocabulary) or vocabulary[index] != token:
+                    vocabulary.insert(index, token)
+
+    def remove(self, items):
+        """Drop items from the index."""
+        for item in items:
+            self._unlink((item.type, item.id))
+
+    def _range(self, term):
+        """Return the vocabulary slice of tokens equal to or starting with a term."""
+        vocabulary = self._vocabulary
+        start = bisect.bisect_left(vocabulary, term)
+        return start, bisect.bisect_left(vocabulary, term + _MAX_CHAR, start)
+
+    def _matches(self, term):
+        """Return the tokens a term matches, exactly or as a prefix."""
+        start, end = self._range(term)
+        return [token for token in self._vocabulary[start:end] if token in self._postings]
+
+    def _ordered_matches(self, term, tokens):
+        """Return the items matching a term, shortest name first.
+
+        Orders are cached per term and kept current as items change, so
+        ``tokens`` is only used on a cache miss.
+        """
+        ordered = self._ordered.get(term)
+        if ordered is not None:
+            self._ordered.move_to_end(term)
+            return ordered
+
+        postings = self._postings
+        ordered = sorted(
+            set().union(*(postings[token] for token in tokens)), key=self._order.__getitem__
+        )
+        capacity = search_config['ordered_entries']
+        if len(ordered) <= capacity:
+            self._ordered[term] = ordered
+            self._ordered_entries += len(ordered)
+            while self._ordered_entries > capacity:
+                _, evicted = self._ordered.popitem(last=False)
+                self._ordered_entries -= len(evicted)
+        return ordered
+
+    def search(self, query, limit, item_type=None):
+        """Return up to ``limit`` (rank, item) pairs matching every query term.
+
+        A term matches a token equal to it or starting with it. Results rank
+        by the number of exactly matched terms, then by shorter names. Lower
+        ranks are better.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        # Candidates come from the most selective term; the others are checked per item
+        postings = self._postings
+        matches = []
+        for term in terms:
+            if term in self._ordered:
+                matches.append((len(self._ordered[term]), term, None))
+                continue
+            start, end = self._range(term)
+            if end - start > _SCAN_LIMIT:
+                # Too many tokens to count postings of; nearly all hold at least one
+                matches.append((end - start, term, None))
+            else:
+                tokens = self._matches(term)
+                matches.append((sum(len(postings[token]) for token in tokens), term, tokens))
+        size, term, tokens = min(matches, key=itemgetter(0))
+        item_type = item_type.casefold() if item_type else None
+        item_tokens = self._tokens
+        order = self._order
+
+        def _exact_matches(key, checked=terms):
+            if item_type and (key[0] or '').casefold() != item_type:
+                return None
+            matched = item_tokens[key]
+            exact = 0
+            for term in checked:
+                if term in matched:
+                    exact += 1
+                elif not any(token.startswith(term) for token in matched):
+                    return None
+            return exact
+
+        others = [other for other in terms if other != term]
+        term_postings = postings.get(term, _EMPTY)
+
+        def _candidate_matches(key):
+            # Candidates match ``term`` already; only its exactness is left
+            exact = _exact_matches(key, others)
+            if exact is not None and key in term_postings:
+                exact += 1
+            return exact
+
+        if size <= _SCAN_LIMIT:
+            if tokens is None:
+                candidates = self._ordered[term]
+            else:
+                candidates = set().union(*(postings[token] for token in tokens))
+            ranked = []
+            for key in candidates:
+                exact = _candidate_matches(key)
+                if exact is not None:
+                    ranked.append(((-exact, order[key]), key))
+            ranked = heapq.nsmallest(limit, ranked, key=itemgetter(0))
+            return [(rank, self._items[key]) for rank, key in ranked]
+
+        # Walk candidates shortest name first, bucketed by exact matches, and
+        # stop once ``limit`` items sit at the best level unseen items can reach.
+        # Few exact matches are ranked upfront, leaving only prefix matches to walk.
+        exact_postings = [postings[term] for term in terms if term in postings]
+        best = len(exact_postings)
+        reached = 0
+        buckets = {}
+        exact_keys = _EMPTY
+        if sum(map(len, exact_postings)) <= _SCAN_LIMIT:
+            exact_keys = set().union(*exact_postings)
+            for key in sorted(exact_keys, key=order.__getitem__):
+                exact = _exact_matches(key)
+                if exact is not None:
+                    buckets.setdefault(exact, []).append(key)
+                    reached += 1
+            best = 0
+
+        def _walk(keys, check, budget=None):
+            # Returns None if ``budget`` keys were walked without finishing
+            found = {exact: list(bucket) for exact, bucket in buckets.items()}
+            count = reached
+            for step, key in enumerate(keys):
+                if step == budget:
+                    return None
+                if key in exact_keys:
+                    continue
+                exact = check(key)
+                if exact is None:
+                    continue
+                found.setdefault(exact, []).append(key)
+                if exact >= best:
+                    count += 1
+                    if count >= limit:
+                        break
+            return found
+
+        found = buckets
+        if reached < limit:
+            found = None
+            if term not in self._ordered and len(self._items) * limit * 2 < size * size:
+                # Broad terms match often enough that walking every item in
+                # rank order finds the first results sooner than sorting them
+                found = _walk(self._ranked, _exact_matches, min(size, _WALK_LIMIT))
+            if found is None:
+                found = _walk(
+                    self._ordered_matches(term, tokens or self._matches(term)), _candidate_matches
+                )
+
+        results = []
+        for exact in sorted(found, reverse=True):
+            for key in found[exact][:limit - len(results)]:
+                results.append(((-exact, order[key]), self._items[key]))
+        return results
+
+
+def _store(key, index):
+    _indexes[key] = index
+    _indexes.move_to_end(key)
+    while len(_indexes) > search_config['index_size']:
+        _indexes.popitem(last=False)
+
+
+def update(provider, org_id, user_id, previous_version, version, changed, removed):
+    """Apply a sync's changes to this worker's index, if it holds one.
+
+    Changes only apply to an index of the snapshot they were diffed against.
+    Any other index is left stale and rebuilt on its next search, as is one
+    facing a bulk change, so the rebuild runs off the event loop.
+    """
+    key = (provider, org_id, user_id)
+    index = _indexes.get(key)
+    if index is None or index.version != previous_version:
+        return
+    if (len(changed) + len(removed)) * 8 > len(index):
+        del _indexes[key]
+        return
+    index.add(changed)
+    index.remove(removed)
+    index.version = version
+
+
+def _build(payload, version):
+    index = SearchIndex(version)
+    index.add(redis_client.decode_items(payload))
+    return index
+
+
+async def _rebuild(key):
+    try:
+        payload, version = await redis_client.get_snapshot_payload(*key)
+        if payload is None:
+            return None
+        index = await offload.compute(_build, payload, version)
+        _store(key, index)
+        return index
+    finally:
+        del _builds[key]
+
+
+async def get_index(provider, org_id, user_id, synced_since=None):
+    """Return a current index of a user's synced snapshot, or None without one.
+
+    With ``synced_since`` (a Unix time), a snapshot synced before then counts
+    as missing. Stale indexes are rebuilt through the offload executor, and
+    concurrent searches of one snapshot share a single rebuild.
+    """
+    key = (provider, org_id, user_id)
+    version, synced_at = await redis_client.get_snapshot_state(provider, org_id, user_id)
+    if version is None:
+        _indexes.pop(key, None)
+        return None
+    if synced_since is not None and (synced_at is None or synced_at < synced_since):
+        return None
+    index = _indexes.get(key)
+    if index is not None and index.version == version:
+        _indexes.move_to_end(key)
+        return index
+
+    build = _builds.get(key)
+    if build is None:
+        build = _builds[key] = asyncio.ensure_future(_rebuild(key))
+    # Shielded so one cancelled search does not cancel the shared rebuild
+    return await asyncio.shield(build)
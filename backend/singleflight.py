@@ -0,0 +1,90 @@
+import asyncio
+import contextlib
+import secrets
+
+import redis_client
+from config import singleflight as singleflight_config
+
+_inflight = {}
+
+
+async def _keep_lock(lock_key, token):
+    """Extend a held lock until cancelled so long fetches keep leadership."""
+    interval = max(singleflight_config['lock_ttl'] / 3, 1)
+    while True:
+        await asyncio.sleep(interval)
+        await redis_client.extend_lock(lock_key, token, singleflight_config['lock_ttl'])
+
+
+async def _lead(key, fn, encode, lock_key, token):
+    """Run fn as the flight leader and hand its result to waiting workers.
+
+    Without ``encode`` the result is not handed off; waiting workers read
+    what fn stored once the lock is released.
+    """
+    result_key = f'singleflight:{key}:result'
+    keeper = asyncio.create_task(_keep_lock(lock_key, token))
+    try:
+        if encode is None:
+            return await fn()
+        await redis_client.delete_key(result_key)
+        result = await fn()
+        await redis_client.add_key_value(
+            result_key, encode(result), expire=singleflight_config['result_ttl']
+        )
+        return result
+    finally:
+        keeper.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await keeper
+        await redis_client.release_lock(lock_key, token)
+
+
+async def _run_distributed(key, fn, encode, decode, read):
+    """Run fn once across workers, or wait for another worker's result."""
+    lock_key = f'singleflight:{key}:lock'
+    result_key = f'singleflight:{key}:result'
+    token = secrets.token_hex(16)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + singleflight_config['wait_timeout']
+
+    while loop.time() < deadline:
+        if await redis_client.acquire_lock(lock_key, token, singleflight_config['lock_ttl']):
+            return await _lead(key, fn, encode, lock_key, token)
+
+        # Another worker leads: wait for its result, or for the lock to be
+        # released without one (leader failed), then try to lead ourselves
+        while loop.time() < deadline:
+            await asyncio.sleep(singleflight_config['poll_interval'])
+            if read is not None:
+                if await redis_client.get_value(lock_key) is not None:
+                    continue
+                result = await read()
+                if result is not None:
+                    return result
+                break
+            payload, holder = await redis_client.mget([result_key, lock_key])
+            if payload is not None:
+                return decode(payload)
+            if holder is None:
+                break
+
+    return await fn()
+
+
+async def run(key, fn, encode=None, decode=None, read=None):
+    """Share a single call of fn between concurrent callers with the same key.
+
+    Callers in this process await one task; callers in other workers are
+    coalesced through a Redis lock. When fn stores its result somewhere
+    itself, such as a cache, ``read`` returns it from there (or None if it
+    is missing) once the leader releases the lock. Otherwise the leader's
+    result is handed off through a short-lived key via ``encode``/``decode``.
+    A caller that is cancelled does not cancel the shared flight.
+    """
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_run_distributed(key, fn, encode, decode, read))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(task)
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+
+import orjson
+from fastapi import HTTPException
+from fastapi.responses import ORJSONResponse, StreamingResponse
+
+from integrations.integration_item import serialize_items, serialize_item_lines
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+_FED = object()
+
+
+async def merge(*iterables):
+    """Yield values from several async iterables concurrently, in arrival order."""
+    queue = asyncio.Queue(maxsize=max(len(iterables), 1))
+
+    async def _drain(iterable):
+        try:
+            async for value in iterable:
+                await queue.put((value, None))
+        except Exception as e:
+            await queue.put((_DONE, e))
+        else:
+            await queue.put((_DONE, None))
+
+    tasks = [asyncio.create_task(_drain(iterable)) for iterable in iterables]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            value, error = await queue.get()
+            if error is not None:
+                raise error
+            if value is _DONE:
+                remaining -= 1
+                continue
+            yield value
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def merge_bounded(iterables, limit):
+    """Yield values from a stream of async iterables, draining at most ``limit`` at once.
+
+    ``iterables`` is itself an async iterable, so sources can be discovered
+    while earlier ones are still being drained. Queues are bounded, so a
+    slow consumer holds back every source.
+    """
+    queue = asyncio.Queue(maxsize=limit)
+    semaphore = asyncio.Semaphore(limit)
+    tasks = set()
+    running = 0
+
+    async def _drain(iterable):
+        try:
+            async for value in iterable:
+                await queue.put((value, None))
+        except Exception as e:
+            await queue.put((_DONE, e))
+        else:
+            await queue.put((_DONE, None))
+        finally:
+            semaphore.release()
+
+    async def _feed():
+        nonlocal running
+        try:
+            async for iterable in iterables:
+                await semaphore.acquire()
+                running += 1
+                task = asyncio.create_task(_drain(iterable))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except Exception as e:
+            await queue.put((_FED, e))
+        else:
+            await queue.put((_FED, None))
+
+    feeder = asyncio.create_task(_feed())
+    try:
+        fed = False
+        while not fed or running:
+            value, error = await queue.get()
+            if error is not None:
+                raise error
+            if value is _FED:
+                fed = True
+            elif value is _DONE:
+                running -= 1
+            else:
+                yield value
+    finally:
+        feeder.cancel()
+        for task in list(tasks):
+            task.cancel()
+
+
+class ItemsResponse(ORJSONResponse):
+    """JSON response for IntegrationItem lists encoded directly with orjson."""
+
+    def render(self, content):
+        return serialize_items(content)
+
+
+async def ndjson_response(pages):
+    """Stream pages of IntegrationItems as an NDJSON response.
+
+    The first page is awaited before the response starts so that upstream
+    errors on the initial request still surface as regular HTTP errors.
+    Errors after that are reported as a trailing ``{"error": ...}`` line.
+    """
+    pages = pages.__aiter__()
+    try:
+        first = await pages.__anext__()
+    except StopAsyncIteration:
+        first = []
+
+    async def _lines():
+        yield serialize_item_lines(first)
+        try:
+            async for items in pages:
+                yield serialize_item_lines(items)
+        except HTTPException as e:
+            yield orjson.dumps({
+                'error': {'status_code': e.status_code, 'detail': e.detail}
+            }) + b'\n'
+
+    return StreamingResponse(_lines(), media_type='application/x-ndjson')
+
+
+def completed_response(loads):
+    """Stream provider loads as NDJSON lines in the order they finish.
+
+    ``loads`` maps providers to coroutines returning their items, or None to
+    leave the provider out. The loads start right away and run concurrently.
+    Each one gives a ``{"provider": ..., "items": [...]}`` line, or a
+    ``{"provider": ..., "error": ...}`` line if it fails, so one provider's
+    failure does not fail the others.
+    """
+    async def _run(provider, load):
+        try:
+            items = await load
+        except HTTPException as e:
+            error = {'status_code': e.status_code, 'detail': e.detail}
+        except Exception as e:
+            logger.exception('Loading %s items failed', provider)
+            error = {'status_code': 500, 'detail': str(e)}
+        else:
+            return None if items is None else {'provider': provider, 'items': items}
+        return {'provider': provider, 'error': error}
+
+    tasks = [asyncio.create_task(_run(provider, load)) for provider, load in loads.items()]
+
+    async def _lines():
+        try:
+            for task in asyncio.as_completed(tasks):
+                line = await task
+                if line is not None:
+                    yield orjson.dumps(line) + b'\n'
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(_lines(), media_type='application/x-ndjson')
@@ -0,0 +1,54 @@
+"""ArrayParser fed in chunks against parse_array on the whole body."""
+import ijson
+import orjson
+import pytest
+
+from json_stream import ArrayParser, parse_array
+
+_BODY = orjson.dumps({
+    'results': [
+        {'id': '1', 'name': 'Ünïcode ☃ name', 'size': 1.5, 'tags': ['a', 'b'], 'nested': {'x': [1, {'y': None}]}},
+        {'id': '2', 'name': 'quote " and \\ backslash', 'size': -20, 'archived': True},
+        {'id': '3', 'name': '', 'size': 1e-7, 'nested': {}},
+    ],
+    'paging': {'next': {'after': 'cursor-3'}},
+    'has_more': False,
+}, option=orjson.OPT_INDENT_2)
+_FIELDS = ('paging.next.after', 'has_more', 'missing')
+
+
+def _named(element):
+    return element['id'] if element.get('name') else None
+
+
+def _parse(body, splits, convert=None):
+    parser = ArrayParser('results', _FIELDS, convert)
+    elements = []
+    start = 0
+    for end in (*splits, len(body)):
+        elements += parser.feed(body[start:end])
+        start = end
+    elements += parser.close()
+    return elements, parser.fields
+
+
+@pytest.mark.parametrize('convert', [None, _named], ids=['raw', 'convert'])
+def test_every_chunk_boundary(convert):
+    expected = parse_array(_BODY, 'results', _FIELDS, convert)
+    for split in range(len(_BODY) + 1):
+        assert _parse(_BODY, (split,), convert) == expected
+
+
+def test_byte_at_a_time():
+    assert _parse(_BODY, range(1, len(_BODY))) == parse_array(_BODY, 'results', _FIELDS)
+
+
+def test_missing_array():
+    body = b'{"paging": {"next": {"after": "x"}}}'
+    assert _parse(body, (7,)) == parse_array(body, 'results', _FIELDS)
+
+
+@pytest.mark.parametrize('cut', [1, len(_BODY) // 2, len(_BODY) - 1])
+def test_truncated_body(cut):
+    with pytest.raises(ijson.IncompleteJSONError):
+        _parse(_BODY[:cut], (cut // 2,))
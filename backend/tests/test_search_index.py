@@ -0,0 +1,89 @@
+"""SearchIndex results against a brute-force scan of the same items.
+
+Names draw on a small vocabulary so terms match many items, and the scan
+and walk limits are lowered so small indexes take every search path.
+"""
+import random
+
+import pytest
+
+import search_index
+from integrations.integration_item import IntegrationItem
+from search_index import SearchIndex, tokenize
+
+_TYPES = ('Base', 'Table', 'page', 'Contact')
+_WORDS = ('alpha', 'alp', 'al', 'beta', 'bet', 'gamma', 'game', 'delta', 'del', 'x', 'épée', 'Straße')
+
+
+def _item(rng, number):
+    name = ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(0, 3)))
+    return IntegrationItem(id=str(number), type=rng.choice(_TYPES), name=name or None)
+
+
+def _expected(items, query, limit, item_type=None):
+    """Rank every item by scanning it, as SearchIndex.search documents."""
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return []
+    ranks = []
+    for item in items.values():
+        if item_type and item.type.casefold() != item_type.casefold():
+            continue
+        tokens = set(tokenize(item.name) + tokenize(item.type))
+        if not all(any(token.startswith(term) for token in tokens) for term in terms):
+            continue
+        exact = sum(term in tokens for term in terms)
+        name = (item.name or '').casefold()
+        ranks.append((-exact, (len(name), name)))
+    return sorted(ranks)[:limit]
+
+
+def _check(index, items, query, limit, item_type=None):
+    results = index.search(query, limit, item_type)
+    assert [rank for rank, _ in results] == _expected(items, query, limit, item_type)
+    for rank, item in results:
+        assert items[(item.type, item.id)] is item
+        assert _expected({None: item}, query, 1, item_type) == [rank]
+
+
+def _queries(rng):
+    words = [word[:rng.randint(1, len(word))] for word in rng.sample(_WORDS, 3)]
+    return [
+        words[0],
+        words[0].upper(),
+        ' '.join(words[:2]),
+        ' '.join(words),
+        f'{words[0]} {rng.choice(_TYPES)[:3]}',
+        'zzz',
+        '',
+    ]
+
+
+@pytest.fixture(params=[(4, 16), (64, 10_000), (2048, 10_000)], ids=['walk', 'ordered', 'scan'])
+def limits(request, monkeypatch):
+    scan, walk = request.param
+    monkeypatch.setattr(search_index, '_SCAN_LIMIT', scan)
+    monkeypatch.setattr(search_index, '_WALK_LIMIT', walk)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_search_matches_brute_force(limits, seed):
+    rng = random.Random(seed)
+    items = {}
+    index = SearchIndex()
+    for round in range(6):
+        # A bulk load first, then changes small enough to be applied in place
+        count = 400 if round == 0 else rng.randint(1, 20)
+        added = [_item(rng, rng.randrange(600)) for _ in range(count)]
+        removed = rng.sample(list(items.values()), min(len(items), rng.randint(0, 10)))
+        index.add(added)
+        items.update(((item.type, item.id), item) for item in added)
+        index.remove(removed)
+        for item in removed:
+            items.pop((item.type, item.id), None)
+        assert len(index) == len(items)
+
+        for query in _queries(rng):
+            for limit in (1, 5, 50):
+                _check(index, items, query, limit)
+            _check(index, items, query, 10, rng.choice(_TYPES).lower())
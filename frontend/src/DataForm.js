@@ -9,14 +9,15 @@ const endpoints = {
     'HubSpot': 'hubspot',
 };
 
-export const DataForm = ({ integrationType, credentials }) => {
+export const DataForm = ({ integrationType, user, org }) => {
     const [data, setData] = useState(null);
     const endpoint = endpoints[integrationType];
 
     const handleLoad = async () => {
         try {
             const fd = new FormData();
-            fd.append('credentials', JSON.stringify(credentials));
+            fd.append('user_id', user);
+            fd.append('org_id', org);
             const res = await axios.post(`http://localhost:8000/integrations/${endpoint}/load`, fd);
             setData(res.data);
         } catch (e) {
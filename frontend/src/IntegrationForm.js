@@ -127,7 +127,7 @@ export const IntegrationForm = () => {
                     </Box>
                 ) : (
                     <Box sx={{ width: '100%', maxWidth: 900, marginLeft: '20%' }}>
-                        <DataForm integrationType={params?.type} credentials={params?.credentials} />
+                        <DataForm integrationType={params?.type} user={user} org={org} />
                     </Box>
                 )}
             </Box>
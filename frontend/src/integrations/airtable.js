@@ -63,8 +63,9 @@ export const AirtableIntegration = ({ user, org, integrationParams, setIntegrati
             formData.append('user_id', user);
             formData.append('org_id', org);
             const response = await axios.post(`${AIRTABLE_URL}credentials`, formData);
-            const credentials = response.data; 
-            if (credentials) {
+            // Only the connection status; loads use the stored credentials
+            const credentials = response.data;
+            if (credentials?.connected) {
                 setIsConnecting(false);
                 setIsConnected(true);
                 setIntegrationParams(prev => ({ ...prev, credentials: credentials, type: 'Airtable' }));